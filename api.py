@@ -1,4 +1,7 @@
-from flask_restx import Api, fields
+from flask import current_app
+from flask_restx import Api, fields, inputs
+from schema_cache import schema_cache
+from service import MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE, DEFAULT_CHANGES_PAGE_SIZE, DEFAULT_HISTOGRAM_BUCKETS, DEFAULT_STATS_GROUPS, SEARCH_MODES
 
 # Initialize API
 authorizations = {
@@ -19,6 +22,13 @@ api = Api(
     doc='/docs'
 )
 
+def asset_values(obj):
+    """An asset's data keyed by field name, from its document when document reads are enabled"""
+    schema = schema_cache.get(obj.asset_type_id)
+    if current_app.config['ASSET_DOCUMENT_READS'] and obj.document is not None:
+        return obj.get_document_values(schema)
+    return obj.get_all_fields_with_values(schema)
+
 # API models/schemas
 asset_field = api.model('AssetField', {
     'id': fields.Integer(readonly=True),
@@ -50,9 +60,187 @@ asset_data = api.model('AssetData', {
 asset = api.model('Asset', {
     'id': fields.Integer(readonly=True),
     'asset_type_id': fields.Integer(),
-    'data': fields.Raw(attribute=lambda x: x.get_all_fields_with_values())
+    'data': fields.Raw(attribute=asset_values)
+})
+
+asset_bulk_input = api.model('AssetBulkInput', {
+    'assets': fields.List(fields.Nested(asset_data), required=True)
+})
+
+asset_bulk_created = api.model('AssetBulkCreated', {
+    'index': fields.Integer(description='Position of the record in the request'),
+    'id': fields.Integer()
+})
+
+field_error = api.model('FieldError', {
+    'field': fields.String(description='Field the error is about, null when the whole data is invalid'),
+    'message': fields.String()
 })
 
+asset_bulk_error = api.model('AssetBulkError', {
+    'index': fields.Integer(description='Position of the record in the request'),
+    'message': fields.String(),
+    'errors': fields.List(fields.Nested(field_error), description='Every invalid field of the record')
+})
+
+asset_bulk_result = api.model('AssetBulkResult', {
+    'created': fields.List(fields.Nested(asset_bulk_created)),
+    'errors': fields.List(fields.Nested(asset_bulk_error))
+})
+
+asset_patch = api.model('AssetPatch', {
+    'id': fields.Integer(required=True),
+    'data': fields.Raw(required=True, description='Values to set, fields that are left out keep their value')
+})
+
+asset_bulk_patch_input = api.model('AssetBulkPatchInput', {
+    'assets': fields.List(fields.Nested(asset_patch), required=True)
+})
+
+asset_bulk_updated = api.model('AssetBulkUpdated', {
+    'index': fields.Integer(description='Position of the record in the request'),
+    'id': fields.Integer()
+})
+
+asset_bulk_patch_result = api.model('AssetBulkPatchResult', {
+    'updated': fields.List(fields.Nested(asset_bulk_updated)),
+    'errors': fields.List(fields.Nested(asset_bulk_error))
+})
+
+asset_change = api.model('AssetChange', {
+    'seq': fields.Integer(description='Position in the change log'),
+    'entity': fields.String(enum=['asset', 'asset_type']),
+    'entity_id': fields.Integer(description='ID of the asset or asset type'),
+    'asset_type_id': fields.Integer(),
+    'op': fields.String(enum=['create', 'update', 'add_field']),
+    'data': fields.Raw(description='Assets: the values written, by field name. '
+                                   'Asset types: name and the types of the fields created or added'),
+    'created_at': fields.DateTime()
+})
+
+asset_change_page = api.model('AssetChangePage', {
+    'items': fields.List(fields.Nested(asset_change)),
+    'next_since': fields.Integer(description='Pass as `since` to fetch the next batch, the same since when nothing is new')
+})
+
+job_input = api.model('JobInput', {
+    'kind': fields.String(required=True, enum=['backfill_field_default', 'import_assets']),
+    'params': fields.Raw(required=True, description='backfill_field_default: {asset_type_id, field, value}, '
+                                                    'import_assets: {assets: [{asset_type_id, data}, ...]}')
+})
+
+job = api.model('Job', {
+    'id': fields.Integer(readonly=True),
+    'kind': fields.String(),
+    'status': fields.String(attribute=lambda j: j.status.value, enum=['queued', 'running', 'succeeded', 'failed']),
+    'progress': fields.Integer(description='Assets or records processed so far'),
+    'total': fields.Integer(description='Assets or records to process, null until the job started'),
+    'result': fields.Raw(description='import_assets: {created, failed, errors}'),
+    'error': fields.String(description='Why the job failed'),
+    'attempts': fields.Integer(),
+    'created_at': fields.DateTime(),
+    'started_at': fields.DateTime(),
+    'finished_at': fields.DateTime()
+})
+
+number_stats = api.model('NumberFieldStats', {
+    'field': fields.String(description='Field name'),
+    'count': fields.Integer(description='Assets with a value for the field'),
+    'sum': fields.Float(),
+    'min': fields.Float(),
+    'max': fields.Float(),
+    'avg': fields.Float()
+})
+
+histogram_bucket = api.model('HistogramBucket', {
+    'lower': fields.Float(),
+    'upper': fields.Float(description='Exclusive, except for the last bucket'),
+    'count': fields.Integer()
+})
+
+number_field_stats = api.inherit('NumberFieldHistogram', number_stats, {
+    'histogram': fields.List(fields.Nested(histogram_bucket))
+})
+
+stats_group = api.model('StatsGroup', {
+    'value': fields.String(description='Value of the group_by field'),
+    'count': fields.Integer(description='Assets with this value'),
+    'fields': fields.List(fields.Nested(number_stats))
+})
+
+asset_type_stats = api.model('AssetTypeStats', {
+    'asset_type_id': fields.Integer(),
+    'asset_count': fields.Integer(),
+    'fields': fields.List(fields.Nested(number_field_stats)),
+    'groups': fields.List(fields.Nested(stats_group), description='Only when group_by is given')
+})
+
+asset_page = api.model('AssetPage', {
+    'items': fields.List(fields.Nested(asset)),
+    'limit': fields.Integer(),
+    'next_cursor': fields.Integer(description='Pass as `after` to fetch the next page, null on the last page')
+})
+
+search_hit = api.model('SearchHit', {
+    'id': fields.Integer(description='Asset ID'),
+    'score': fields.Float(description='Share of the best matching value covered by the query, 1 for an exact match')
+})
+
+search_page = api.model('SearchPage', {
+    'items': fields.List(fields.Nested(search_hit)),
+    'limit': fields.Integer(),
+    'offset': fields.Integer(),
+    'next_offset': fields.Integer(description='Pass as `offset` to fetch the next page, null on the last page')
+})
+
+asset_type_page = api.model('AssetTypePage', {
+    'items': fields.List(fields.Nested(asset_type)),
+    'limit': fields.Integer(),
+    'next_cursor': fields.Integer(description='Pass as `after` to fetch the next page, null on the last page')
+})
+
+# Keyset pagination arguments; without either of them list endpoints return every row
+pagination_args = api.parser()
+pagination_args.add_argument('limit', type=inputs.int_range(1, MAX_PAGE_SIZE), location='args', help='Page size')
+pagination_args.add_argument('after', type=inputs.natural, location='args', help='Return rows with an id greater than this cursor')
+
+# Arguments of the asset type stats endpoint
+stats_args = api.parser()
+stats_args.add_argument('buckets', type=inputs.int_range(1, 100), default=DEFAULT_HISTOGRAM_BUCKETS, location='args',
+                        help='Histogram buckets per NUMBER field')
+stats_args.add_argument('group_by', location='args', help='TEXT field whose most common values get their own stats')
+stats_args.add_argument('limit', type=inputs.int_range(1, MAX_PAGE_SIZE), default=DEFAULT_STATS_GROUPS, location='args',
+                        help='Number of group_by values')
+
+# Arguments of the change feed
+changes_args = api.parser()
+changes_args.add_argument('since', type=inputs.natural, default=0, location='args',
+                          help='Return changes with a greater sequence number')
+changes_args.add_argument('limit', type=inputs.int_range(1, MAX_PAGE_SIZE), default=DEFAULT_CHANGES_PAGE_SIZE,
+                          location='args', help='Batch size')
+changes_args.add_argument('asset_type_id', type=int, location='args', help='Only changes of this asset type and its assets')
+
+# Arguments of the asset event stream
+events_args = api.parser()
+events_args.add_argument('asset_type_id', type=int, location='args', help='Only events of assets of this type')
+events_args.add_argument('ids', type=int, action='split', location='args', help='Comma separated asset ids to follow')
+events_args.add_argument('since', type=inputs.natural, location='args',
+                         help='Replay events after this id first, like the Last-Event-ID header')
+
+# Arguments of the asset search endpoint; pages by offset since hits are ordered by score
+search_args = api.parser()
+search_args.add_argument('q', required=True, location='args', help='Text to look for in TEXT field values')
+search_args.add_argument('asset_type_id', type=int, required=True, location='args', help='Asset type to search')
+search_args.add_argument('fields', action='split', location='args',
+                         help='Comma separated TEXT fields to search, all of them by default')
+search_args.add_argument('mode', choices=SEARCH_MODES, default='substring', location='args',
+                         help='substring matches anywhere in a value, prefix only at its start')
+search_args.add_argument('limit', type=inputs.int_range(1, MAX_PAGE_SIZE), default=DEFAULT_PAGE_SIZE, location='args',
+                         help='Page size')
+search_args.add_argument('offset', type=inputs.natural, default=0, location='args', help='Hits to skip')
+
 # API namespaces
 asset_ns = api.namespace('api/asset-types', description='Asset type operations')
 assets_ns = api.namespace('api/assets', description='Asset operations')
+jobs_ns = api.namespace('api/jobs', description='Background job operations')
+changes_ns = api.namespace('api/changes', description='Change feed of assets and asset types')
@@ -2,6 +2,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from functools import wraps
 from flask_migrate import Migrate
+from sqlalchemy.engine import make_url
 import os
 
 app = Flask(__name__)
@@ -9,12 +10,88 @@ app = Flask(__name__)
 # Configure SQLAlchemy
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI') or os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Database of the ASGI app (asgi.py), defaults to SQLALCHEMY_DATABASE_URI through asyncpg/aiosqlite
+app.config['ASYNC_DATABASE_URI'] = os.getenv('ASYNC_DATABASE_URI')
+
+# Read replicas serving GET requests, as comma separated URLs; a client that just
+# wrote keeps reading from the primary for REPLICA_READ_YOUR_WRITES_SECONDS
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica_{i}': url for i, url in enumerate(u for u in os.getenv('DB_REPLICA_URLS', '').split(',') if u)
+}
+app.config['REPLICA_READ_YOUR_WRITES_SECONDS'] = int(os.getenv('REPLICA_READ_YOUR_WRITES_SECONDS', 5))
+
+# Connection pool of each worker process; SQLite keeps SQLAlchemy's defaults
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+}
+if not (app.config['SQLALCHEMY_DATABASE_URI'] or '').startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(
+        pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    )
+    if app.config['DB_STATEMENT_TIMEOUT_MS']:
+        # Applied by PostgreSQL to every statement of the session
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {
+            'options': f"-c statement_timeout={app.config['DB_STATEMENT_TIMEOUT_MS']}"
+        }
+
+# Process-local cache of asset type schemas
+app.config['SCHEMA_CACHE_SIZE'] = int(os.getenv('SCHEMA_CACHE_SIZE', 256))
+app.config['SCHEMA_CACHE_TTL'] = int(os.getenv('SCHEMA_CACHE_TTL', 60))
+
+# Serve asset data from the denormalized assets.document column instead of asset_values
+app.config['ASSET_DOCUMENT_READS'] = os.getenv('ASSET_DOCUMENT_READS', 'false').lower() in ('1', 'true', 'yes')
+
+# Build response payloads directly instead of through flask-restx marshal
+app.config['FAST_SERIALIZER'] = os.getenv('FAST_SERIALIZER', 'true').lower() in ('1', 'true', 'yes')
+
+# Background jobs run by `flask jobs-worker`: rows per transaction, seconds between
+# polls, and seconds without a heartbeat after which another worker takes a job over
+app.config['JOB_BATCH_SIZE'] = int(os.getenv('JOB_BATCH_SIZE', 1000))
+app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 2))
+app.config['JOB_STALE_SECONDS'] = int(os.getenv('JOB_STALE_SECONDS', 300))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# Live asset events streamed at /api/assets/events: memory (per process) or postgres
+# (LISTEN/NOTIFY, shared by every process); streams send a comment every
+# EVENTS_HEARTBEAT_SECONDS and end when a client falls EVENTS_QUEUE_SIZE events behind
+app.config['EVENTS_BACKEND'] = os.getenv('EVENTS_BACKEND', 'memory')
+app.config['EVENTS_CHANNEL'] = os.getenv('EVENTS_CHANNEL', 'asset_changes')
+app.config['EVENTS_HEARTBEAT_SECONDS'] = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', 15))
+app.config['EVENTS_QUEUE_SIZE'] = int(os.getenv('EVENTS_QUEUE_SIZE', 1000))
+# Each open stream holds a worker thread, so a worker serves at most this many and
+# keeps one of its GUNICORN_THREADS for regular requests by default; 0 removes the limit
+app.config['EVENTS_MAX_STREAMS'] = int(
+    os.getenv('EVENTS_MAX_STREAMS') or max(int(os.getenv('GUNICORN_THREADS', 4)) - 1, 1)
+)
 
 # Additional configuration based on environment
 app.config['TESTING'] = os.getenv('FLASK_ENV') == 'testing'
 app.config['DEBUG'] = os.getenv('FLASK_ENV') == 'development'
 
-db = SQLAlchemy(app)
+# Response cache for read endpoints: none, memory (per worker) or redis (shared)
+app.config['RESPONSE_CACHE_BACKEND'] = os.getenv('RESPONSE_CACHE_BACKEND', 'none')
+app.config['RESPONSE_CACHE_URL'] = os.getenv('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 300))
+app.config['RESPONSE_CACHE_SIZE'] = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+
+# Prometheus-format request metrics at /metrics
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Bulk updates upsert asset_values with INSERT ... ON CONFLICT, which only these databases have
+SUPPORTED_DATABASES = ('postgresql', 'sqlite')
+for uri in [app.config['SQLALCHEMY_DATABASE_URI'], app.config['ASYNC_DATABASE_URI'],
+            *app.config['SQLALCHEMY_BINDS'].values()]:
+    backend = uri and make_url(uri).get_backend_name()
+    if backend and backend not in SUPPORTED_DATABASES:
+        raise ValueError(f"Unsupported database {backend}, use PostgreSQL or SQLite")
+
+from replicas import RoutingSession, replicas
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+replicas.init_app(app)
 
 # Static API key
 API_KEY = 'Dyn4m1cAsS3tKey'
@@ -29,11 +106,21 @@ def require_api_key(f):
     return decorated
 migrate = Migrate(app, db)
 
+from response_cache import response_cache
+response_cache.init_app(app)
+
+from metrics import metrics
+metrics.init_app(app)
+
+from events import broker
+broker.init_app(app)
+
 # Import routes after db initialization to avoid circular imports
 from api import api
 api.init_app(app)
 
 from routes import *
+import commands
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0')
@@ -0,0 +1,206 @@
+"""ASGI entry point serving the asset and asset type routes with async handlers.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+Requests wait on the database through an async engine (asyncpg, or aiosqlite
+for SQLite) instead of holding a worker thread, so one process can keep
+thousands of slow clients in flight. Swagger docs, conditional requests,
+response caching, metrics and exports stay on the WSGI app in app.py.
+"""
+import json
+from contextlib import asynccontextmanager
+from functools import wraps
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from app import API_KEY
+from async_service import AsyncAssetTypeService, AsyncAssetService, create_engine, create_sessionmaker
+from models import FieldType, ValidationError
+from routes import parse_filters
+from serializers import dumps, asset_type_payload, field_payload
+from service import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, BULK_MAX_ITEMS
+
+class JSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content):
+        return dumps(content)
+
+class HTTPError(Exception):
+    def __init__(self, status_code, message, errors=None):
+        self.status_code = status_code
+        self.message = message
+        self.errors = errors
+
+def endpoint(f):
+    """Check the API key, open a session for the request and turn HTTPError into a JSON error"""
+    @wraps(f)
+    async def decorated(request):
+        if request.headers.get('X-API-KEY') != API_KEY:
+            return JSONResponse({'message': 'Unauthorized'}, 401)
+        try:
+            async with request.app.state.sessionmaker() as session:
+                result = await f(request, session)
+        except HTTPError as e:
+            body = {'message': e.message}
+            if e.errors is not None:
+                body['errors'] = e.errors
+            return JSONResponse(body, e.status_code)
+        data, status = result if isinstance(result, tuple) else (result, 200)
+        return JSONResponse(data, status)
+    return decorated
+
+async def payload(request):
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPError(400, 'Request body must be JSON')
+    if not isinstance(data, dict):
+        raise HTTPError(400, 'Request body must be a JSON object')
+    return data
+
+def int_arg(request, name, minimum, maximum=None):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise HTTPError(400, f'{name} must be an integer')
+    if value < minimum or (maximum is not None and value > maximum):
+        raise HTTPError(400, f'{name} is out of range')
+    return value
+
+def pagination(request):
+    """(paginated, limit, after) from the limit and after query arguments"""
+    limit = int_arg(request, 'limit', 1, MAX_PAGE_SIZE)
+    after = int_arg(request, 'after', 0)
+    return limit is not None or after is not None, limit or DEFAULT_PAGE_SIZE, after
+
+@endpoint
+async def asset_types(request, session):
+    if request.method == 'POST':
+        data = await payload(request)
+        try:
+            new_type = await AsyncAssetTypeService.create_asset_type(session, data['name'], data['fields'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPError(400, str(e))
+        return asset_type_payload(new_type), 201
+
+    paginated, limit, after = pagination(request)
+    if not paginated:
+        return [asset_type_payload(t) for t in await AsyncAssetTypeService.get_all_asset_types(session)]
+    items, next_cursor = await AsyncAssetTypeService.get_asset_types_page(session, limit, after)
+    return {'items': [asset_type_payload(t) for t in items], 'limit': limit, 'next_cursor': next_cursor}
+
+@endpoint
+async def asset_type_item(request, session):
+    found = await AsyncAssetTypeService.get_asset_type(session, request.path_params['type_id'])
+    if found is None:
+        raise HTTPError(404, 'Asset type not found')
+    return asset_type_payload(found)
+
+@endpoint
+async def asset_type_fields(request, session):
+    type_id = request.path_params['type_id']
+    if request.method == 'POST':
+        data = await payload(request)
+        try:
+            field = await AsyncAssetTypeService.add_field_to_asset_type(
+                session, type_id, data['name'], FieldType(data['field_type'])
+            )
+        except (KeyError, ValueError) as e:
+            raise HTTPError(400, str(e))
+        if field is None:
+            raise HTTPError(404, 'Asset type not found')
+        return field_payload(field), 201
+
+    type_fields = await AsyncAssetTypeService.get_asset_type_fields(session, type_id)
+    if type_fields is None:
+        raise HTTPError(404, 'Asset type not found')
+    return [field_payload(f) for f in type_fields]
+
+@endpoint
+async def assets(request, session):
+    if request.method == 'POST':
+        data = await payload(request)
+        try:
+            return await AsyncAssetService.create_asset(session, data['asset_type_id'], data['data']), 201
+        except ValidationError as e:
+            raise HTTPError(400, str(e), e.errors)
+        except (KeyError, ValueError) as e:
+            raise HTTPError(400, str(e))
+
+    if request.method == 'PATCH':
+        records = (await payload(request)).get('assets')
+        if not isinstance(records, list):
+            raise HTTPError(400, 'assets must be a list')
+        if len(records) > BULK_MAX_ITEMS:
+            raise HTTPError(400, f'At most {BULK_MAX_ITEMS} assets can be updated per request')
+        updated, errors = await AsyncAssetService.bulk_update_assets(session, records)
+        return {'updated': updated, 'errors': errors}, 400 if errors and not updated else 200
+
+    paginated, limit, after = pagination(request)
+    asset_type_id = int_arg(request, 'asset_type_id', 0)
+    filters = parse_filters(request.query_params.multi_items())
+    try:
+        items, next_cursor = await AsyncAssetService.get_asset_rows(
+            session, asset_type_id, filters, limit=limit if paginated else None, after=after
+        )
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    if not paginated:
+        return items
+    return {'items': items, 'limit': limit, 'next_cursor': next_cursor}
+
+@endpoint
+async def assets_bulk(request, session):
+    records = (await payload(request)).get('assets')
+    if not isinstance(records, list):
+        raise HTTPError(400, 'assets must be a list')
+    if len(records) > BULK_MAX_ITEMS:
+        raise HTTPError(400, f'At most {BULK_MAX_ITEMS} assets can be created per request')
+    created, errors = await AsyncAssetService.bulk_create_assets(session, records)
+    return {'created': created, 'errors': errors}, 400 if errors and not created else 201
+
+@endpoint
+async def asset_item(request, session):
+    asset_id = request.path_params['asset_id']
+    if request.method == 'PUT':
+        data = await payload(request)
+        try:
+            found = await AsyncAssetService.update_asset(session, asset_id, data['data'])
+        except ValidationError as e:
+            raise HTTPError(400, str(e), e.errors)
+        except (KeyError, ValueError) as e:
+            raise HTTPError(400, str(e))
+    else:
+        found = await AsyncAssetService.get_asset(session, asset_id)
+    if found is None:
+        raise HTTPError(404, 'Asset not found')
+    return found
+
+routes = [
+    Route('/api/asset-types/', asset_types, methods=['GET', 'POST']),
+    Route('/api/asset-types/{type_id:int}/', asset_type_item, methods=['GET']),
+    Route('/api/asset-types/{type_id:int}/fields/', asset_type_fields, methods=['GET', 'POST']),
+    Route('/api/assets/', assets, methods=['GET', 'POST', 'PATCH']),
+    Route('/api/assets/bulk/', assets_bulk, methods=['POST']),
+    Route('/api/assets/{asset_id:int}/', asset_item, methods=['GET', 'PUT']),
+]
+
+def create_app(database_uri=None):
+    """Build the ASGI app on its own async engine, disposed of at shutdown"""
+    engine = create_engine(database_uri)
+
+    @asynccontextmanager
+    async def lifespan(application):
+        yield
+        await engine.dispose()
+
+    application = Starlette(routes=routes, lifespan=lifespan)
+    application.state.engine = engine
+    application.state.sessionmaker = create_sessionmaker(engine)
+    return application
+
+application = create_app()
@@ -0,0 +1,286 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload
+from sqlalchemy.pool import StaticPool
+from app import app
+from events import broker
+from models import AssetType, Asset, AssetChange, AssetField, AssetValue, FieldType
+from response_cache import response_cache
+from schema_cache import schema_cache, schema_query, build_schema
+from service import (
+    DEFAULT_PAGE_SIZE, asset_page_query, asset_rows_query, pivot_asset_rows, value_predicates,
+    document_for, upsert_statement, plan_updates, stored_values_query, rebuild_planned_documents,
+    document_updates, validate_new_assets, validate_asset_updates, record_type_ids, record_asset_ids,
+    lock_assets_query, asset_change_row, asset_type_change_row, change_log_lock
+)
+
+# Async drivers standing in for the sync ones of SQLALCHEMY_DATABASE_URI
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+async def invalidate_cache(*tags):
+    """response_cache.invalidate off the event loop, the redis backend does blocking network I/O"""
+    await asyncio.to_thread(response_cache.invalidate, *tags)
+
+def async_database_uri(uri):
+    """The URI of the same database through its async driver"""
+    url = make_url(uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver for {url.get_backend_name()} databases")
+    return url.set(drivername=driver)
+
+def create_engine(uri=None):
+    """Create the async engine, for ASYNC_DATABASE_URI or else the async twin of SQLALCHEMY_DATABASE_URI"""
+    url = make_url(uri or app.config['ASYNC_DATABASE_URI'] or async_database_uri(app.config['SQLALCHEMY_DATABASE_URI']))
+    options = {}
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # Every connection to an in-memory database would see a different, empty database
+            options['poolclass'] = StaticPool
+    else:
+        # Same pool settings as the sync engine, connect_args are driver specific
+        options.update({k: v for k, v in app.config['SQLALCHEMY_ENGINE_OPTIONS'].items() if k != 'connect_args'})
+        if app.config['DB_STATEMENT_TIMEOUT_MS']:
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(app.config['DB_STATEMENT_TIMEOUT_MS'])}}
+    return create_async_engine(url, **options)
+
+def create_sessionmaker(engine):
+    # Objects are serialized after commit, they must not expire and lazy load then
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+async def get_schema(session, type_id):
+    """Async counterpart of schema_cache.get, sharing its entries"""
+    # The version lookup may be a Redis round trip
+    schema, version = await asyncio.to_thread(schema_cache.lookup, type_id)
+    if schema is None:
+        schema = build_schema(type_id, (await session.execute(schema_query(type_id))).all())
+        if schema is not None:
+            schema_cache.store(type_id, schema, version)
+    return schema
+
+async def get_schemas(session, type_ids):
+    return {type_id: await get_schema(session, type_id) for type_id in type_ids}
+
+async def record_changes(session, changes):
+    """Async counterpart of service.record_changes"""
+    if not changes:
+        return
+    lock = change_log_lock(session.bind.dialect.name)
+    if lock is not None:
+        await session.execute(lock)
+    seqs = (await session.scalars(
+        insert(AssetChange.__table__).returning(AssetChange.seq, sort_by_parameter_order=True), changes
+    )).all()
+    notify = broker.prepare(session.sync_session, [dict(change, seq=seq) for change, seq in zip(changes, seqs)])
+    if notify is not None:
+        await session.execute(notify)
+
+async def paginate(session, query, column, limit, after=None):
+    """Async counterpart of service.paginate for select() statements"""
+    if after is not None:
+        query = query.where(column > after)
+    items = (await session.scalars(query.order_by(column).limit(limit + 1))).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = getattr(items[-1], column.key)
+    return items, next_cursor
+
+async def read_asset_rows(session, page, limit=None, asset_type_id=None):
+    """Run asset_rows_query for a page query and pivot the rows into (assets, next_cursor)"""
+    rows = (await session.execute(asset_rows_query(page, app.config['ASSET_DOCUMENT_READS'], asset_type_id))).all()
+    schemas = await get_schemas(session, {row[1] for row in rows})
+    return pivot_asset_rows(rows, schemas.__getitem__, limit)
+
+class AsyncAssetTypeService:
+    """AssetTypeService on an AsyncSession; missing types are returned as None rather than aborting"""
+    @staticmethod
+    async def get_all_asset_types(session):
+        """Get all asset types"""
+        query = select(AssetType).options(selectinload(AssetType.fields)).order_by(AssetType.id)
+        return (await session.scalars(query)).all()
+
+    @staticmethod
+    async def get_asset_types_page(session, limit=DEFAULT_PAGE_SIZE, after=None):
+        """Get one page of asset types with an id greater than after"""
+        query = select(AssetType).options(selectinload(AssetType.fields))
+        return await paginate(session, query, AssetType.id, limit, after)
+
+    @staticmethod
+    async def get_asset_type(session, type_id):
+        """Get a specific asset type by ID"""
+        return await session.get(AssetType, type_id, options=[selectinload(AssetType.fields)])
+
+    @staticmethod
+    async def create_asset_type(session, name, fields_data):
+        """Create a new asset type with fields"""
+        new_asset_type = AssetType(name=name, fields=[])
+        session.add(new_asset_type)
+
+        # Reuse existing fields, looked up in one query
+        names = [field_data['name'] for field_data in fields_data]
+        existing = {f.name: f for f in await session.scalars(select(AssetField).where(AssetField.name.in_(names)))}
+        for field_data in fields_data:
+            field = existing.get(field_data['name'])
+            if not field:
+                field = AssetField(name=field_data['name'], field_type=FieldType(field_data['field_type']))
+                session.add(field)
+                existing[field.name] = field
+            new_asset_type.fields.append(field)
+
+        await session.flush()
+        await record_changes(session, [asset_type_change_row('create', new_asset_type, new_asset_type.fields)])
+        await session.commit()
+        await asyncio.to_thread(schema_cache.invalidate, new_asset_type.id)
+        await invalidate_cache('asset_types')
+        return new_asset_type
+
+    @staticmethod
+    async def add_field_to_asset_type(session, type_id, field_name, field_type):
+        """Add a field to an asset type"""
+        asset_type = await AsyncAssetTypeService.get_asset_type(session, type_id)
+        if asset_type is None:
+            return None
+        if any(f.name == field_name for f in asset_type.fields):
+            raise ValueError(f"Field {field_name} already exists for this asset type")
+
+        field = await session.scalar(select(AssetField).where(AssetField.name == field_name))
+        if not field:
+            field = AssetField(name=field_name, field_type=field_type)
+            session.add(field)
+
+        asset_type.fields.append(field)
+        # The association change alone would not bump the type's updated_at
+        asset_type.updated_at = datetime.utcnow()
+        await session.flush()
+        await record_changes(session, [asset_type_change_row('add_field', asset_type, [field])])
+        await session.commit()
+        await asyncio.to_thread(schema_cache.invalidate, type_id)
+        await invalidate_cache('asset_types', f'asset_type:{type_id}')
+        return field
+
+    @staticmethod
+    async def get_asset_type_fields(session, type_id):
+        """Get all fields for an asset type"""
+        asset_type = await AsyncAssetTypeService.get_asset_type(session, type_id)
+        return None if asset_type is None else asset_type.fields
+
+class AsyncAssetService:
+    """AssetService on an AsyncSession, reading and returning asset payloads rather than ORM objects"""
+    @staticmethod
+    async def get_asset_rows(session, asset_type_id=None, filters=None, limit=None, after=None):
+        """Get assets as response payloads, returning (assets, next_cursor)"""
+        page = asset_page_query(asset_type_id, limit, after)
+        if filters:
+            names = {name for name, _, _ in filters}
+            fields = {f.name: f for f in await session.scalars(select(AssetField).where(AssetField.name.in_(names)))}
+            page = page.where(*value_predicates(filters, fields, asset_type_id))
+        return await read_asset_rows(session, page, limit, asset_type_id)
+
+    @staticmethod
+    async def get_asset(session, asset_id):
+        """Get a specific asset by ID"""
+        assets, _ = await read_asset_rows(session, asset_page_query().where(Asset.id == asset_id))
+        return assets[0] if assets else None
+
+    @staticmethod
+    async def create_asset(session, asset_type_id, field_values):
+        """Create a new asset with field values"""
+        schema = await get_schema(session, asset_type_id)
+        if schema is None:
+            raise ValueError(f"Asset type {asset_type_id} does not exist")
+        rows = schema.value_rows(field_values)
+
+        asset_id = await session.scalar(
+            insert(Asset).values(asset_type_id=asset_type_id, document=document_for(schema, rows)).returning(Asset.id)
+        )
+        if rows:
+            await session.execute(
+                insert(AssetValue.__table__),
+                [dict(row, asset_id=asset_id, asset_type_id=asset_type_id) for row in rows]
+            )
+        await record_changes(session, [asset_change_row('create', asset_id, schema, rows)])
+        await session.commit()
+        await invalidate_cache('assets')
+        return await AsyncAssetService.get_asset(session, asset_id)
+
+    @staticmethod
+    async def _write_updates(session, updates):
+        """Async counterpart of AssetService._write_updates, the caller commits"""
+        values, documents, rebuild = plan_updates(updates)
+        if values:
+            await session.execute(upsert_statement(session.bind.dialect.name), values)
+        if rebuild:
+            schemas = {current.id: schema for current, schema, _ in updates}
+            stored = await session.execute(stored_values_query(rebuild))
+            rebuild_planned_documents(documents, rebuild, schemas, stored)
+        await session.execute(update(Asset), document_updates(documents))
+        await record_changes(session, [asset_change_row('update', current.id, schema, rows) for current, schema, rows in updates])
+
+    @staticmethod
+    async def update_asset(session, asset_id, field_values):
+        """Update an asset's field values"""
+        current = (await session.execute(lock_assets_query([asset_id]))).first()
+        if current is None:
+            return None
+        schema = await get_schema(session, current.asset_type_id)
+        rows = schema.value_rows(field_values)
+
+        await AsyncAssetService._write_updates(session, [(current, schema, rows)])
+        await session.commit()
+        await invalidate_cache('assets', f'asset:{asset_id}')
+        return await AsyncAssetService.get_asset(session, asset_id)
+
+    @staticmethod
+    async def bulk_create_assets(session, records):
+        """Create many assets in a single transaction, returning the created ids and per-record errors"""
+        schemas = await get_schemas(session, record_type_ids(records))
+        valid, errors = validate_new_assets(records, schemas)
+        if not valid:
+            return [], errors
+
+        asset_ids = (await session.scalars(
+            insert(Asset).returning(Asset.id, sort_by_parameter_order=True),
+            [{'asset_type_id': schema.type_id, 'document': document_for(schema, rows)} for _, schema, rows in valid]
+        )).all()
+        values = [
+            dict(row, asset_id=asset_id, asset_type_id=schema.type_id)
+            for (_, schema, rows), asset_id in zip(valid, asset_ids)
+            for row in rows
+        ]
+        if values:
+            await session.execute(insert(AssetValue.__table__), values)
+        await record_changes(session, [
+            asset_change_row('create', asset_id, schema, rows)
+            for (_, schema, rows), asset_id in zip(valid, asset_ids)
+        ])
+        await session.commit()
+        await invalidate_cache('assets')
+
+        created = [{'index': index, 'id': asset_id} for (index, _, _), asset_id in zip(valid, asset_ids)]
+        return created, errors
+
+    @staticmethod
+    async def bulk_update_assets(session, records):
+        """Update many assets' values in a single transaction, returning the updated ids and per-record errors"""
+        rows = await session.execute(lock_assets_query(record_asset_ids(records)))
+        current = {row.id: row for row in rows}
+        schemas = await get_schemas(session, {row.asset_type_id for row in current.values()})
+
+        valid, errors = validate_asset_updates(records, current, schemas)
+        if not valid:
+            await session.rollback()
+            return [], errors
+
+        await AsyncAssetService._write_updates(session, [(row, schema, rows) for _, row, schema, rows in valid])
+        await session.commit()
+        await invalidate_cache('assets', *{f'asset:{row.id}' for _, row, _, _ in valid})
+
+        updated = [{'index': index, 'id': row.id} for index, row, _, _ in valid]
+        return updated, errors
@@ -0,0 +1,246 @@
+"""Load generator and latency benchmark for the asset API.
+
+Seeds a database with synthetic asset types, fields and assets, then drives the
+Flask app in-process through app.test_client() and reports latency percentiles,
+throughput and SQL statements per request for each scenario.
+
+    python benchmarks/bench.py --assets 20000 --output before.json
+    python benchmarks/bench.py --assets 20000 --output after.json --compare before.json
+
+Point --database-url at a scratch PostgreSQL database to benchmark against a
+real server; it defaults to an in-memory SQLite database.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ['list', 'get', 'create', 'update', 'bulk', 'patch']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:///:memory:',
+                        help='Database to seed and benchmark, use a scratch database')
+    parser.add_argument('--types', type=int, default=5, help='Number of asset types')
+    parser.add_argument('--fields', type=int, default=10, help='Fields per asset type')
+    parser.add_argument('--assets', type=int, default=10000, help='Assets to seed, spread over the types')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--page-size', type=int, default=100, help='Page size of list requests')
+    parser.add_argument('--bulk-size', type=int, default=1000, help='Records per bulk create and bulk update request')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'Comma separated subset of {",".join(SCENARIOS)}')
+    parser.add_argument('--legacy-serializer', action='store_true',
+                        help='Serialize responses with flask-restx marshal instead of the fast serializer')
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse data already in the database')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for generated data')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Compare against results previously written with --output')
+    return parser.parse_args()
+
+class DataGenerator:
+    """Generates asset data with skewed, realistic looking value distributions"""
+    MODELS = ['ThinkPad', 'XPS', 'MacBook', 'Latitude', 'Surface', 'ZenBook', 'Spectre', 'Yoga', 'Pavilion', 'Envy']
+
+    def __init__(self, rng, fields):
+        self.rng = rng
+        self.fields = fields
+
+    def value(self, name, field_type):
+        if field_type == 'number':
+            # Prices and quantities are long tailed
+            return round(self.rng.lognormvariate(6, 1), 2)
+        if name == 'field_0':
+            return ''.join(self.rng.choices(string.ascii_uppercase + string.digits, k=12))
+        # A few popular values and a long tail of rare ones
+        rank = min(int(self.rng.paretovariate(1.2)), 100)
+        return self.MODELS[rank % len(self.MODELS)] + ('' if rank < len(self.MODELS) else f' {rank}')
+
+    def data(self, fraction=1.0):
+        return {
+            name: self.value(name, field_type)
+            for name, field_type in self.fields
+            if self.rng.random() < fraction
+        }
+
+def seed(app, args, rng):
+    """Create the asset types and assets, returning {type_id: generator}"""
+    from app import db
+    from service import AssetTypeService, AssetService
+
+    fields = [(f'field_{i}', 'text' if i % 2 == 0 else 'number') for i in range(args.fields)]
+    generators = {}
+    with app.app_context():
+        if not args.skip_seed:
+            db.create_all()
+            for t in range(args.types):
+                asset_type = AssetTypeService.create_asset_type(
+                    f'bench_type_{t}_{rng.randrange(10 ** 9)}',
+                    [{'name': name, 'field_type': field_type} for name, field_type in fields]
+                )
+                generators[asset_type.id] = DataGenerator(rng, fields)
+
+            type_ids = list(generators)
+            started = time.perf_counter()
+            remaining = args.assets
+            while remaining > 0:
+                batch = min(remaining, args.bulk_size)
+                records = []
+                for _ in range(batch):
+                    type_id = rng.choice(type_ids)
+                    # Most assets have most of their fields filled in
+                    records.append({'asset_type_id': type_id, 'data': generators[type_id].data(0.9)})
+                AssetService.bulk_create_assets(records)
+                remaining -= batch
+            print(f'Seeded {args.assets} assets over {args.types} types in {time.perf_counter() - started:.1f}s')
+        else:
+            from models import AssetType
+            for asset_type in AssetType.query.all():
+                generators[asset_type.id] = DataGenerator(rng, [(f.name, f.field_type.value) for f in asset_type.fields])
+    return generators
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(samples, wall_time):
+    latencies = [s['latency'] * 1000 for s in samples]
+    cpu = [s['cpu'] * 1000 for s in samples]
+    statements = [s['statements'] for s in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if s['status'] >= 400),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'mean_ms': sum(latencies) / len(latencies),
+        'cpu_mean_ms': sum(cpu) / len(cpu),
+        'throughput_rps': len(samples) / wall_time if wall_time else 0.0,
+        'statements_mean': sum(statements) / len(statements),
+        'statements_max': max(statements),
+    }
+
+def make_requests(scenario, args, rng, generators, asset_types):
+    """Build the (method, url, json) requests of one scenario"""
+    type_ids = list(generators)
+    asset_ids = list(asset_types)
+    count = max(1, args.requests // 10) if scenario in ('bulk', 'patch') else args.requests
+    for _ in range(count):
+        type_id = rng.choice(type_ids)
+        if scenario == 'list':
+            after = rng.choice(asset_ids) if asset_ids and rng.random() < 0.8 else None
+            url = f'/api/assets/?asset_type_id={type_id}&limit={args.page_size}'
+            yield 'GET', url + (f'&after={after}' if after else ''), None
+        elif scenario == 'get':
+            yield 'GET', f'/api/assets/{rng.choice(asset_ids)}/', None
+        elif scenario == 'create':
+            yield 'POST', '/api/assets/', {'asset_type_id': type_id, 'data': generators[type_id].data(0.9)}
+        elif scenario == 'update':
+            asset_id = rng.choice(asset_ids)
+            yield 'PUT', f'/api/assets/{asset_id}/', {'data': generators[asset_types[asset_id]].data(0.3)}
+        elif scenario == 'bulk':
+            records = [{'asset_type_id': type_id, 'data': generators[type_id].data(0.9)} for _ in range(args.bulk_size)]
+            yield 'POST', '/api/assets/bulk/', {'assets': records}
+        elif scenario == 'patch':
+            records = []
+            for asset_id in rng.sample(asset_ids, min(args.bulk_size, len(asset_ids))):
+                records.append({'id': asset_id, 'data': generators[asset_types[asset_id]].data(0.3)})
+            yield 'PATCH', '/api/assets/', {'assets': records}
+
+def run_scenario(client, scenario, args, rng, generators, asset_types, counter):
+    samples = []
+    started = time.perf_counter()
+    for method, url, body in make_requests(scenario, args, rng, generators, asset_types):
+        counter['statements'] = 0
+        cpu_started = time.process_time()
+        request_started = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        response.get_data()
+        samples.append({
+            'latency': time.perf_counter() - request_started,
+            'cpu': time.process_time() - cpu_started,
+            'statements': counter['statements'],
+            'status': response.status_code,
+        })
+    return summarize(samples, time.perf_counter() - started)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    header = f'{"scenario":<10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"cpu ms":>10}{"req/s":>10}{"stmts":>8}{"errors":>8}'
+    print(header)
+    print('-' * len(header))
+    for scenario, r in results.items():
+        print(f'{scenario:<10}{r["p50_ms"]:>10.2f}{r["p95_ms"]:>10.2f}{r["p99_ms"]:>10.2f}'
+              f'{r["cpu_mean_ms"]:>10.2f}{r["throughput_rps"]:>10.1f}{r["statements_mean"]:>8.1f}{r["errors"]:>8}')
+        before = (baseline or {}).get(scenario)
+        if before:
+            deltas = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'cpu_mean_ms', 'throughput_rps', 'statements_mean'):
+                if before[key]:
+                    deltas.append(f'{key} {100 * (r[key] - before[key]) / before[key]:+.1f}%')
+            print(f'{"":<10}vs baseline: ' + ', '.join(deltas))
+
+def main():
+    args = parse_args()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import app, db, API_KEY
+    from models import Asset
+
+    counter = {'statements': 0}
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        counter['statements'] += 1
+
+    rng = random.Random(args.seed)
+    generators = seed(app, args, rng)
+
+    app.config['FAST_SERIALIZER'] = not args.legacy_serializer
+    client = app.test_client()
+    client.environ_base['HTTP_X_API_KEY'] = API_KEY
+    results = {}
+    with app.app_context():
+        asset_types = dict(db.session.query(Asset.id, Asset.asset_type_id).filter(Asset.asset_type_id.in_(generators)))
+        db.session.remove()
+        for scenario in args.scenarios.split(','):
+            if scenario not in SCENARIOS:
+                sys.exit(f'Unknown scenario {scenario}')
+            results[scenario] = run_scenario(client, scenario, args, rng, generators, asset_types, counter)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'timestamp': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'database': args.database_url.split(':', 1)[0],
+                'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+                'results': results,
+            }, f, indent=2)
+        print(f'Results written to {args.output}')
+
+if __name__ == '__main__':
+    main()
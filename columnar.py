@@ -0,0 +1,79 @@
+"""Columnar exports of one asset type as an Arrow IPC stream or a Parquet file.
+
+Each field of the type becomes a typed column, float64 for NUMBER fields and
+string for TEXT fields, so the output loads into pandas, DuckDB or Polars
+without parsing values. Needs the optional pyarrow package.
+"""
+from models import FieldType
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# format: mimetype
+COLUMNAR_FORMATS = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+def arrow_schema(schema):
+    """Arrow schema of the export of an asset type's TypeSchema"""
+    types = {FieldType.TEXT: pa.string(), FieldType.NUMBER: pa.float64()}
+    return pa.schema(
+        [pa.field('id', pa.int64(), nullable=False), pa.field('asset_type_id', pa.int64(), nullable=False)]
+        + [pa.field(field.name, types[field.field_type]) for field in schema.fields.values()]
+    )
+
+def record_batch(target, assets):
+    """Pivot asset payloads into one record batch of the target schema"""
+    columns = [[item['id'] for item in assets], [item['asset_type_id'] for item in assets]]
+    columns += [[item['data'].get(name) for item in assets] for name in target.names[2:]]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, target)], schema=target
+    )
+
+class _Sink:
+    """Write-only file that hands back what a pyarrow writer wrote since it was last drained"""
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_chunks(schema, batches, export_format):
+    """Yield the bytes of an export of batches of asset payloads as soon as each batch is written
+
+    Every batch becomes one Arrow record batch, or one Parquet row group.
+    """
+    if pa is None:
+        raise RuntimeError("Columnar exports need the pyarrow package")
+    target = arrow_schema(schema)
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, target) if export_format == 'parquet' else pa.ipc.new_stream(sink, target)
+    with writer:
+        for assets in batches:
+            writer.write_batch(record_batch(target, assets))
+            yield sink.drain()
+    # Parquet's footer, or the end of stream marker
+    yield sink.drain()
@@ -0,0 +1,31 @@
+import os
+import socket
+from datetime import datetime, timedelta
+import click
+from app import app
+from jobs import JobService
+from service import AssetService, ChangeService, EXPORT_BATCH_SIZE
+
+@app.cli.command('rebuild-asset-documents')
+@click.option('--asset-type-id', type=int, help='Only rebuild assets of this type')
+@click.option('--batch-size', type=int, default=EXPORT_BATCH_SIZE, show_default=True)
+def rebuild_asset_documents(asset_type_id, batch_size):
+    """Rebuild the denormalized assets.document column from asset_values"""
+    rebuilt = AssetService.rebuild_documents(asset_type_id, batch_size)
+    click.echo(f'Rebuilt {rebuilt} asset documents')
+
+@app.cli.command('jobs-worker')
+@click.option('--once', is_flag=True, help='Exit when no job is left instead of polling for more')
+def jobs_worker(once):
+    """Run queued background jobs"""
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    click.echo(f'Worker {worker} waiting for jobs')
+    ran = JobService.work(worker, once)
+    click.echo(f'Ran {ran} jobs')
+
+@app.cli.command('prune-changes')
+@click.option('--keep-days', type=int, default=30, show_default=True, help='Keep the changes of this many days')
+def prune_changes(keep_days):
+    """Delete old entries of the change log"""
+    deleted = ChangeService.prune_changes(datetime.utcnow() - timedelta(days=keep_days))
+    click.echo(f'Deleted {deleted} changes')
@@ -11,6 +11,12 @@ flask db upgrade
 
 if [ "$1" = "test" ]; then
   pytest tests/ -v
-else
+elif [ "$1" = "asgi" ]; then
+  uvicorn asgi:application --host 0.0.0.0 --port 8000
+elif [ "$1" = "worker" ]; then
+  exec flask jobs-worker
+elif [ "$1" = "dev" ]; then
   flask run --host=0.0.0.0
+else
+  exec gunicorn -c gunicorn.conf.py app:app
 fi
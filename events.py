@@ -0,0 +1,175 @@
+"""Live asset create and update events for the Server-Sent Events stream.
+
+Events are the asset entries of the change log (see ChangeService), delivered
+once their transaction committed and identified by their sequence number. With
+the memory backend a process only sees its own writes. With the postgres
+backend every write runs pg_notify in its transaction, and each process LISTENs
+on one dedicated connection, so all workers (and the ASGI app and job workers)
+see every event.
+"""
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Session.info key of the events a transaction publishes when it commits
+PENDING_EVENTS = 'pending_asset_events'
+# NOTIFY payloads must stay below 8000 bytes, larger events go out without their data
+MAX_NOTIFY_PAYLOAD = 7900
+# Seconds between checks of the LISTEN connection, and before reconnecting it after an error
+LISTEN_POLL_INTERVAL = 5
+LISTEN_RETRY_INTERVAL = 1
+
+def asset_event(seq, asset_id, asset_type_id, op, data):
+    return {'seq': seq, 'id': asset_id, 'asset_type_id': asset_type_id, 'op': op, 'data': data}
+
+def notify_payload(e):
+    payload = json.dumps(e)
+    if len(payload) > MAX_NOTIFY_PAYLOAD:
+        payload = json.dumps(dict(e, data=None))
+    return payload
+
+class StreamLimitReached(Exception):
+    """This process already serves EVENTS_MAX_STREAMS event streams"""
+
+class Subscription:
+    """Queue of the events one stream asked for; marked overflowed rather than blocking publishers"""
+    def __init__(self, asset_type_id=None, ids=None, maxsize=1000, stream=False):
+        self.asset_type_id = asset_type_id
+        self.ids = set(ids) if ids else None
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+        self.stream = stream
+
+    def matches(self, e):
+        if self.asset_type_id and e['asset_type_id'] != self.asset_type_id:
+            return False
+        return self.ids is None or e['id'] in self.ids
+
+    def offer(self, e):
+        if self.overflowed or not self.matches(e):
+            return
+        try:
+            self.queue.put_nowait(e)
+        except queue.Full:
+            # The stream ends and the client resumes from the change log with Last-Event-ID
+            self.overflowed = True
+
+class EventBroker:
+    """Fans committed asset changes out to the event streams of this process"""
+    def __init__(self):
+        self.backend = 'memory'
+        self.channel = 'asset_changes'
+        self.queue_size = 1000
+        self.max_streams = 0
+        self._subscriptions = set()
+        self._streams = 0
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def init_app(self, app):
+        self.backend = app.config['EVENTS_BACKEND']
+        if self.backend not in ('memory', 'postgres'):
+            raise ValueError(f"Unknown events backend {self.backend}")
+        self.channel = app.config['EVENTS_CHANNEL']
+        self.queue_size = app.config['EVENTS_QUEUE_SIZE']
+        self.max_streams = app.config['EVENTS_MAX_STREAMS']
+        # On the base class, so async sessions and every session subclass publish too
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def prepare(self, session, changes):
+        """Queue the asset changes a transaction logged, as {seq, entity, ...} rows, to publish once it commits
+
+        Returns a statement the caller runs in the transaction with the postgres
+        backend, whose NOTIFYs PostgreSQL only delivers on commit; otherwise None.
+        """
+        events = [
+            asset_event(c['seq'], c['entity_id'], c['asset_type_id'], c['op'], c['data'])
+            for c in changes if c['entity'] == 'asset'
+        ]
+        if not events:
+            return None
+        if self.backend == 'postgres':
+            return text(
+                'SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload'
+            ).bindparams(channel=self.channel, payloads=[notify_payload(e) for e in events])
+        session.info.setdefault(PENDING_EVENTS, []).extend(events)
+        return None
+
+    def _after_commit(self, session):
+        events = session.info.pop(PENDING_EVENTS, None)
+        if events:
+            self.publish(events)
+
+    def _after_rollback(self, session):
+        session.info.pop(PENDING_EVENTS, None)
+
+    def publish(self, events):
+        """Hand events to the subscriptions of this process"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            for e in events:
+                subscription.offer(e)
+
+    def subscribe(self, asset_type_id=None, ids=None, stream=False):
+        """Start receiving the events of one asset type and/or some asset ids
+
+        Subscriptions of event streams, which hold a worker thread while open, count
+        against max_streams; StreamLimitReached is raised once they are all taken.
+        """
+        subscription = Subscription(asset_type_id, ids, self.queue_size, stream)
+        with self._lock:
+            if stream and self.max_streams and self._streams >= self.max_streams:
+                raise StreamLimitReached()
+            self._subscriptions.add(subscription)
+            self._streams += stream
+            if self.backend == 'postgres' and self._listener is None:
+                # Started on first use, so the gunicorn master never owns it
+                self._listener = threading.Thread(target=self._listen, args=(db.engine,),
+                                                  name='asset-events-listener', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+                self._streams -= subscription.stream
+
+    def _listen(self, engine):
+        """LISTEN for the events of every process on a connection of its own, reconnecting after errors"""
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                # Out of the pool for good, it would otherwise sit in LISTEN state between requests
+                connection.detach()
+                driver_connection = connection.driver_connection
+                driver_connection.autocommit = True
+                driver_connection.cursor().execute(f'LISTEN "{self.channel}"')
+                while True:
+                    if select.select([driver_connection], [], [], LISTEN_POLL_INTERVAL) == ([], [], []):
+                        continue
+                    driver_connection.poll()
+                    events = []
+                    while driver_connection.notifies:
+                        events.append(json.loads(driver_connection.notifies.pop(0).payload))
+                    if events:
+                        self.publish(events)
+            except Exception:
+                logger.exception('Listening for asset events failed, reconnecting')
+                time.sleep(LISTEN_RETRY_INTERVAL)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+broker = EventBroker()
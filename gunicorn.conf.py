@@ -0,0 +1,36 @@
+"""Gunicorn settings for serving app:app in production, all overridable through env vars.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Each worker process keeps its own SQLAlchemy pool, so the database sees up to
+GUNICORN_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. Keep
+DB_POOL_SIZE at least GUNICORN_THREADS with gthread workers.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+# gthread by default. Async worker classes such as gevent would also need psycopg2 patched
+# (psycogreen), which this setup does not do
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Recycle workers now and then so slow leaks cannot grow without bound
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+# Import the app and build model metadata once in the master instead of in every worker
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+def post_fork(server, worker):
+    """Give each worker its own pool, instead of the connections the master opened while preloading"""
+    from app import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the master's connections open for the master
+            engine.dispose(close=False)
@@ -0,0 +1,192 @@
+"""Background jobs kept in the jobs table and run by worker processes.
+
+    flask jobs-worker
+
+Requests submit a job and get its id back right away. Workers claim queued jobs
+with a conditional UPDATE, which works the same on every database without an
+external broker, then run them one chunk per transaction. Each chunk commits
+together with the job's progress and checkpoint, so a job whose worker died is
+claimed again once its heartbeat is JOB_STALE_SECONDS old and resumes after
+the last committed chunk. A chunk only commits while its worker still owns the
+job, so a worker that stalled past that point cannot write the same chunk again.
+"""
+import time
+from datetime import datetime, timedelta
+from flask import abort, current_app
+from sqlalchemy import and_, func, or_, select, update
+from app import db
+from models import Asset, Job, JobStatus
+from response_cache import response_cache
+from schema_cache import schema_cache
+from service import AssetService, record_type_ids, validate_new_assets
+
+# Failed records kept in the result of an import, the others are only counted
+JOB_MAX_ERRORS = 1000
+# Queued or stale jobs a worker tries to claim per poll
+JOB_CLAIM_CANDIDATES = 10
+
+class JobLost(Exception):
+    """The job was claimed again by another worker while this one ran a chunk"""
+
+def _check_backfill(params):
+    schema = schema_cache.get(params.get('asset_type_id'))
+    if schema is None:
+        raise ValueError(f"Asset type {params.get('asset_type_id')} does not exist")
+    if 'value' not in params:
+        raise ValueError("value is required")
+    schema.value_rows({params.get('field'): params['value']})
+
+def _backfill_chunk(job, batch_size):
+    params = job.params
+    if job.total is None:
+        job.total = db.session.scalar(
+            select(func.count(Asset.id)).where(Asset.asset_type_id == params['asset_type_id'])
+        )
+    scanned, job.checkpoint = AssetService.backfill_field_default(
+        params['asset_type_id'], params['field'], params['value'], job.checkpoint, batch_size
+    )
+    job.progress += scanned
+    return job.checkpoint is None
+
+def _check_import(params):
+    if not isinstance(params.get('assets'), list):
+        raise ValueError("assets must be a list")
+
+def _import_chunk(job, batch_size):
+    records = job.params['assets']
+    start = job.checkpoint or 0
+    chunk = records[start:start + batch_size]
+    schemas = {type_id: schema_cache.get(type_id) for type_id in record_type_ids(chunk)}
+    valid, errors = validate_new_assets(chunk, schemas)
+    created = AssetService._insert_assets(valid) if valid else []
+
+    result = job.result or {'created': 0, 'failed': 0, 'errors': []}
+    errors = [dict(error, index=error['index'] + start) for error in errors]
+    # A new dict, in-place changes of a JSON column are not tracked
+    job.result = {
+        'created': result['created'] + len(created),
+        'failed': result['failed'] + len(errors),
+        'errors': (result['errors'] + errors)[:JOB_MAX_ERRORS],
+    }
+    job.total = len(records)
+    job.progress = job.checkpoint = start + len(chunk)
+    return job.checkpoint >= len(records)
+
+# kind: (params check run on submission, chunk runner returning whether the job is done)
+JOB_KINDS = {
+    'backfill_field_default': (_check_backfill, _backfill_chunk),
+    'import_assets': (_check_import, _import_chunk),
+}
+
+class JobService:
+    @staticmethod
+    def submit_job(kind, params):
+        """Queue a job after checking its parameters"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind {kind}")
+        if not isinstance(params, dict):
+            raise ValueError("params must be an object")
+        check, _ = JOB_KINDS[kind]
+        check(params)
+        job = Job(kind=kind, params=params)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def get_job(job_id):
+        """Get a specific job by ID"""
+        job = db.session.get(Job, job_id)
+        if job is None:
+            abort(404)
+        return job
+
+    @staticmethod
+    def claim_job(worker):
+        """Claim the oldest queued job, or a running one whose worker stopped heartbeating
+
+        Each candidate is claimed with an UPDATE conditioned on the state it was
+        read in, so when workers race for a job exactly one of them updates a row.
+        """
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+        candidates = db.session.execute(
+            select(Job.id, Job.status, Job.heartbeat_at)
+            .where(or_(Job.status == JobStatus.QUEUED,
+                       and_(Job.status == JobStatus.RUNNING, Job.heartbeat_at < stale)))
+            .order_by(Job.id)
+            .limit(JOB_CLAIM_CANDIDATES)
+        ).all()
+        db.session.rollback()
+        for job_id, status, heartbeat_at in candidates:
+            unchanged = Job.heartbeat_at.is_(None) if heartbeat_at is None else Job.heartbeat_at == heartbeat_at
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == status, unchanged)
+                .values(status=JobStatus.RUNNING, worker=worker, attempts=Job.attempts + 1,
+                        started_at=func.coalesce(Job.started_at, now), heartbeat_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id, populate_existing=True)
+        return None
+
+    @staticmethod
+    def _still_owned(job_id, worker, attempts, **values):
+        """Write values to a job, in the current transaction, only if this claim of it is still current"""
+        return db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.worker == worker, Job.attempts == attempts)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+
+    @staticmethod
+    def run_job(job):
+        """Run a claimed job to completion, committing every chunk with the job's progress
+
+        Stops without writing anything more once another worker reclaimed the job.
+        """
+        _, run_chunk = JOB_KINDS[job.kind]
+        job_id, worker, attempts = job.id, job.worker, job.attempts
+        try:
+            if attempts > current_app.config['JOB_MAX_ATTEMPTS']:
+                raise RuntimeError(f"Gave up after {attempts - 1} attempts")
+            done = False
+            while not done:
+                done = run_chunk(job, current_app.config['JOB_BATCH_SIZE'])
+                now = datetime.utcnow()
+                if done:
+                    job.status = JobStatus.SUCCEEDED
+                    job.finished_at = now
+                # Fences the chunk: its writes and the progress flushed with it commit together or not at all
+                if not JobService._still_owned(job_id, worker, attempts, heartbeat_at=now):
+                    raise JobLost()
+                db.session.commit()
+                response_cache.invalidate('assets')
+        except JobLost:
+            db.session.rollback()
+        except Exception as e:
+            # Chunks committed so far stay, the failed one is rolled back
+            db.session.rollback()
+            if JobService._still_owned(job_id, worker, attempts, status=JobStatus.FAILED,
+                                       error=str(e) or type(e).__name__, finished_at=datetime.utcnow()):
+                db.session.commit()
+            else:
+                db.session.rollback()
+        return db.session.get(Job, job_id, populate_existing=True)
+
+    @staticmethod
+    def work(worker, once=False):
+        """Claim and run jobs, polling every JOB_POLL_INTERVAL seconds; with once, return when none is left"""
+        ran = 0
+        while True:
+            job = JobService.claim_job(worker)
+            if job is not None:
+                JobService.run_job(job)
+                ran += 1
+            elif once:
+                return ran
+            else:
+                time.sleep(current_app.config['JOB_POLL_INTERVAL'])
@@ -0,0 +1,147 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+class Histogram:
+    """Cumulative histogram per (endpoint, method), rendered in the Prometheus text format"""
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for (endpoint, method), (counts, total, count) in sorted(self._series.items()):
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+class Metrics:
+    """Per-request SQL, serialization and latency instrumentation exposed at /metrics
+
+    Figures are kept per process, so with several workers each one reports its own.
+    """
+    def __init__(self):
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Total time spent handling a request', LATENCY_BUCKETS)
+        self.db_queries = Histogram(
+            'db_queries_per_request', 'SQL statements executed by a request', QUERY_BUCKETS)
+        self.db_time = Histogram(
+            'db_time_seconds', 'Time a request spent waiting on SQL statements', LATENCY_BUCKETS)
+        self.serialization_time = Histogram(
+            'serialization_seconds', 'Time a request spent turning results into its response body', LATENCY_BUCKETS)
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if app.config['METRICS_ENABLED']:
+            app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def register(self, name, description, callback, kind='gauge'):
+        """Report callback() as a gauge or counter on every scrape"""
+        self._callbacks.append((name, description, kind, callback))
+
+    @contextmanager
+    def serializing(self):
+        """Count the time spent in the block as serialization time of the current request"""
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            if has_app_context() and '_metrics' in g:
+                g._metrics['serialize'] += perf_counter() - started
+
+    def serialized(self, marshal_decorator):
+        """Apply a flask-restx marshal decorator, counting the time it takes as serialization time"""
+        def decorator(f):
+            @wraps(f)
+            def handler(*args, **kwargs):
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    g._handler_done = perf_counter()
+            marshalled = marshal_decorator(handler)
+
+            @wraps(marshalled)
+            def decorated(*args, **kwargs):
+                rv = marshalled(*args, **kwargs)
+                done = g.pop('_handler_done', None)
+                if done is not None and '_metrics' in g:
+                    g._metrics['serialize'] += perf_counter() - done
+                return rv
+            return decorated
+        return decorator
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info['metrics_query_start'].pop()
+        if has_app_context() and '_metrics' in g:
+            g._metrics['queries'] += 1
+            g._metrics['db_time'] += elapsed
+
+    def _handle_error(self, context):
+        starts = context.connection.info.get('metrics_query_start') if context.connection else None
+        if starts:
+            starts.pop()
+
+    def _before_request(self):
+        g._metrics = {'start': perf_counter(), 'queries': 0, 'db_time': 0.0, 'serialize': 0.0}
+
+    def _after_request(self, response):
+        stats = g.pop('_metrics', None)
+        if stats is None:
+            return response
+        labels = (request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+        with self._lock:
+            self.request_duration.observe(labels, perf_counter() - stats['start'])
+            self.db_queries.observe(labels, stats['queries'])
+            self.db_time.observe(labels, stats['db_time'])
+            self.serialization_time.observe(labels, stats['serialize'])
+        if current_app.debug:
+            response.headers['X-Debug-Queries'] = str(stats['queries'])
+            response.headers['X-Debug-DB-Time'] = f"{stats['db_time'] * 1000:.1f}ms"
+        return response
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in (self.request_duration, self.db_queries, self.db_time, self.serialization_time):
+                lines.extend(histogram.render())
+        for name, description, kind, callback in self._callbacks:
+            lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {kind}', f'{name} {callback()}'])
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+metrics = Metrics()
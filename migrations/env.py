@@ -1,4 +1,5 @@
 import logging
+import re
 from logging.config import fileConfig
 
 from flask import current_app
@@ -45,6 +46,23 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# Tables the migrations create without a model: the PostgreSQL partitions of asset_values and the
+# SQLite full-text index with its shadow tables. Autogenerate would write a drop_table for each.
+UNMODELED_TABLES = re.compile(r'asset_values_(?:p\d+|fts(?:_\w+)?)')
+
+
+def include_name(name, type_, parent_names):
+    return type_ != 'table' or not UNMODELED_TABLES.fullmatch(name)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Indexes limited to another dialect with ddl_if, like the PostgreSQL trigram index
+    ddl_if = getattr(object, '_ddl_if', None)
+    if type_ == 'index' and ddl_if is not None and ddl_if.dialect is not None:
+        return ddl_if.dialect == context.get_context().dialect.name
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -65,7 +83,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_name=include_name, include_object=include_object
     )
 
     with context.begin_transaction():
@@ -97,6 +116,8 @@ def run_migrations_online():
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_name=include_name,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
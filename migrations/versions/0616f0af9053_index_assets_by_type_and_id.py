@@ -0,0 +1,24 @@
+"""Index assets by type and id for keyset pagination
+
+Revision ID: 0616f0af9053
+Revises: efc6a193bf9e
+Create Date: 2026-10-17 09:12:41.204317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0616f0af9053'
+down_revision = 'efc6a193bf9e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_assets_asset_type_id_id', 'assets', ['asset_type_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_assets_asset_type_id_id', table_name='assets')
@@ -0,0 +1,27 @@
+"""Add denormalized document column to assets
+
+Revision ID: 5d2500210154
+Revises: 6e1d2b7c4a90
+Create Date: 2026-10-17 11:26:05.087113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2500210154'
+down_revision = '6e1d2b7c4a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows stay NULL until `flask rebuild-asset-documents` runs,
+    # reads fall back to asset_values for them in the meantime
+    op.add_column('assets', sa.Column('document', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=True))
+
+
+def downgrade():
+    op.drop_column('assets', 'document')
@@ -0,0 +1,26 @@
+"""Index asset values by field and value for value filters
+
+Revision ID: 6e1d2b7c4a90
+Revises: 0616f0af9053
+Create Date: 2026-10-17 10:03:18.551920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e1d2b7c4a90'
+down_revision = '0616f0af9053'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_asset_values_field_id_number_value', 'asset_values', ['field_id', 'number_value'], unique=False)
+    op.create_index('ix_asset_values_field_id_text_value', 'asset_values', ['field_id', 'text_value'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_asset_values_field_id_text_value', table_name='asset_values')
+    op.drop_index('ix_asset_values_field_id_number_value', table_name='asset_values')
@@ -0,0 +1,48 @@
+"""Add search index over asset text values
+
+Revision ID: 9b3f1e7a2c58
+Revises: 5d2500210154
+Create Date: 2026-10-17 14:02:41.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3f1e7a2c58'
+down_revision = '5d2500210154'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_asset_values_text_value_trgm', 'asset_values', ['text_value'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'text_value': 'gin_trgm_ops'})
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS asset_values_fts USING fts5("
+                   "text_value, content='asset_values', content_rowid='id', tokenize='trigram')")
+        op.execute("CREATE TRIGGER IF NOT EXISTS asset_values_fts_insert AFTER INSERT ON asset_values BEGIN "
+                   "INSERT INTO asset_values_fts(rowid, text_value) VALUES (new.id, new.text_value); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS asset_values_fts_delete AFTER DELETE ON asset_values BEGIN "
+                   "INSERT INTO asset_values_fts(asset_values_fts, rowid, text_value) "
+                   "VALUES ('delete', old.id, old.text_value); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS asset_values_fts_update AFTER UPDATE OF text_value ON asset_values BEGIN "
+                   "INSERT INTO asset_values_fts(asset_values_fts, rowid, text_value) "
+                   "VALUES ('delete', old.id, old.text_value); "
+                   "INSERT INTO asset_values_fts(rowid, text_value) VALUES (new.id, new.text_value); END")
+        # Index the values stored before the table existed
+        op.execute("INSERT INTO asset_values_fts(asset_values_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_asset_values_text_value_trgm', table_name='asset_values', postgresql_using='gin')
+    elif dialect == 'sqlite':
+        for trigger in ('asset_values_fts_insert', 'asset_values_fts_delete', 'asset_values_fts_update'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS asset_values_fts')
@@ -0,0 +1,36 @@
+"""Add asset_changes change log
+
+Revision ID: e81d5c3b7a26
+Revises: c47e2a9d1f03
+Create Date: 2026-10-17 16:05:37.902145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81d5c3b7a26'
+down_revision = 'c47e2a9d1f03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('asset_changes',
+    sa.Column('seq', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('asset_type_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=20), nullable=False),
+    sa.Column('data', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('seq')
+    )
+    op.create_index('ix_asset_changes_asset_type_id_seq', 'asset_changes', ['asset_type_id', 'seq'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_asset_changes_asset_type_id_seq', table_name='asset_changes')
+    op.drop_table('asset_changes')
@@ -0,0 +1,143 @@
+"""Add asset_type_id to asset_values and hash partition it by type on PostgreSQL
+
+Revision ID: f3a9c6e2d184
+Revises: e81d5c3b7a26
+Create Date: 2026-10-17 17:21:54.630218
+
+"""
+import os
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c6e2d184'
+down_revision = 'e81d5c3b7a26'
+branch_labels = None
+depends_on = None
+
+# Fixed once the table is partitioned, changing it later means rewriting the table again
+PARTITIONS = int(os.getenv('ASSET_VALUES_PARTITIONS', 16))
+
+# asset_values_fts triggers, dropped by SQLite together with the table batch mode recreates
+SQLITE_SEARCH_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS asset_values_fts_insert AFTER INSERT ON asset_values BEGIN "
+    "INSERT INTO asset_values_fts(rowid, text_value) VALUES (new.id, new.text_value); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_values_fts_delete AFTER DELETE ON asset_values BEGIN "
+    "INSERT INTO asset_values_fts(asset_values_fts, rowid, text_value) "
+    "VALUES ('delete', old.id, old.text_value); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_values_fts_update AFTER UPDATE OF text_value ON asset_values BEGIN "
+    "INSERT INTO asset_values_fts(asset_values_fts, rowid, text_value) "
+    "VALUES ('delete', old.id, old.text_value); "
+    "INSERT INTO asset_values_fts(rowid, text_value) VALUES (new.id, new.text_value); END",
+]
+
+INDEXES = {
+    'ix_asset_values_asset_id': '(asset_id, field_id)',
+    'ix_asset_values_field_id_number_value': '(field_id, number_value)',
+    'ix_asset_values_field_id_text_value': '(field_id, text_value)',
+    'ix_asset_values_text_value_trgm': 'USING gin (text_value gin_trgm_ops)',
+}
+
+
+def _set_aside_postgresql_table():
+    """Rename asset_values and everything with a schema-wide name, so the new table can take the names
+
+    ix_asset_values_asset_id only exists once upgraded; the downgrade keeps it on the plain table.
+    """
+    op.execute('ALTER TABLE asset_values RENAME TO asset_values_old')
+    op.execute('ALTER TABLE asset_values_old RENAME CONSTRAINT asset_values_pkey TO asset_values_old_pkey')
+    op.execute('ALTER TABLE asset_values_old RENAME CONSTRAINT uq_asset_field_value TO uq_asset_field_value_old')
+    for name in INDEXES:
+        op.execute(f'ALTER INDEX IF EXISTS {name} RENAME TO {name}_old')
+
+
+def _create_postgresql_indexes():
+    for name, columns in INDEXES.items():
+        op.execute(f'CREATE INDEX {name} ON asset_values {columns}')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        _set_aside_postgresql_table()
+        # Primary and unique keys of a partitioned table must include the partition key
+        op.execute("""
+            CREATE TABLE asset_values (
+                id INTEGER NOT NULL DEFAULT nextval('asset_values_id_seq'),
+                asset_id INTEGER NOT NULL REFERENCES assets (id),
+                asset_type_id INTEGER NOT NULL REFERENCES asset_types (id),
+                field_id INTEGER NOT NULL REFERENCES asset_fields (id),
+                text_value VARCHAR,
+                number_value FLOAT,
+                created_at TIMESTAMP WITHOUT TIME ZONE,
+                updated_at TIMESTAMP WITHOUT TIME ZONE,
+                CONSTRAINT asset_values_pkey PRIMARY KEY (asset_type_id, id),
+                CONSTRAINT uq_asset_field_value UNIQUE (asset_type_id, asset_id, field_id)
+            ) PARTITION BY HASH (asset_type_id)
+        """)
+        for remainder in range(PARTITIONS):
+            op.execute(f'CREATE TABLE asset_values_p{remainder} PARTITION OF asset_values '
+                       f'FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})')
+        op.execute("""
+            INSERT INTO asset_values (id, asset_id, asset_type_id, field_id, text_value, number_value,
+                                      created_at, updated_at)
+            SELECT v.id, v.asset_id, a.asset_type_id, v.field_id, v.text_value, v.number_value,
+                   v.created_at, v.updated_at
+            FROM asset_values_old v JOIN assets a ON a.id = v.asset_id
+        """)
+        # Indexed after the copy, which is faster than maintaining them row by row
+        _create_postgresql_indexes()
+        op.execute('ALTER SEQUENCE asset_values_id_seq OWNED BY asset_values.id')
+        op.execute('DROP TABLE asset_values_old')
+        return
+
+    with op.batch_alter_table('asset_values', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('asset_type_id', sa.Integer(), nullable=True))
+    op.execute('UPDATE asset_values SET asset_type_id = '
+               '(SELECT assets.asset_type_id FROM assets WHERE assets.id = asset_values.asset_id)')
+    with op.batch_alter_table('asset_values', schema=None) as batch_op:
+        batch_op.alter_column('asset_type_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_asset_values_asset_type_id', 'asset_types', ['asset_type_id'], ['id'])
+        batch_op.drop_constraint('uq_asset_field_value', type_='unique')
+        batch_op.create_unique_constraint('uq_asset_field_value', ['asset_type_id', 'asset_id', 'field_id'])
+    # The unique key no longer starts with asset_id. Already there when upgrading again after a downgrade.
+    op.create_index('ix_asset_values_asset_id', 'asset_values', ['asset_id', 'field_id'], unique=False,
+                    if_not_exists=True)
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        _set_aside_postgresql_table()
+        op.execute("""
+            CREATE TABLE asset_values (
+                id INTEGER NOT NULL DEFAULT nextval('asset_values_id_seq'),
+                asset_id INTEGER NOT NULL REFERENCES assets (id),
+                field_id INTEGER NOT NULL REFERENCES asset_fields (id),
+                text_value VARCHAR,
+                number_value FLOAT,
+                created_at TIMESTAMP WITHOUT TIME ZONE,
+                updated_at TIMESTAMP WITHOUT TIME ZONE,
+                CONSTRAINT asset_values_pkey PRIMARY KEY (id),
+                CONSTRAINT uq_asset_field_value UNIQUE (asset_id, field_id)
+            )
+        """)
+        op.execute("""
+            INSERT INTO asset_values (id, asset_id, field_id, text_value, number_value, created_at, updated_at)
+            SELECT id, asset_id, field_id, text_value, number_value, created_at, updated_at FROM asset_values_old
+        """)
+        _create_postgresql_indexes()
+        op.execute('ALTER SEQUENCE asset_values_id_seq OWNED BY asset_values.id')
+        op.execute('DROP TABLE asset_values_old')
+        return
+
+    with op.batch_alter_table('asset_values', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_asset_field_value', type_='unique')
+        batch_op.create_unique_constraint('uq_asset_field_value', ['asset_id', 'field_id'])
+        batch_op.drop_constraint('fk_asset_values_asset_type_id', type_='foreignkey')
+        batch_op.drop_column('asset_type_id')
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            op.execute(statement)
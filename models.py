@@ -1,11 +1,49 @@
+import math
+import re
 from app import db
 from datetime import datetime
 from enum import Enum
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import selectinload
 
 class FieldType(str, Enum):
     TEXT = 'text'
     NUMBER = 'number'
 
+class ValidationError(ValueError):
+    """Invalid asset data, with every problem found listed in errors as {field, message}"""
+    def __init__(self, errors):
+        super().__init__('; '.join(error['message'] for error in errors))
+        self.errors = errors
+
+# Decimal and exponent notation as float() reads it, without its inf, nan and underscore forms
+NUMBER_PATTERN = re.compile(r'\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*')
+
+def to_number(value):
+    """The float stored for a NUMBER value, None if it is not a finite number"""
+    # Exact type checks leave out bool, and strings are matched before float() sees them
+    if type(value) not in (int, float) and not (type(value) is str and NUMBER_PATTERN.fullmatch(value)):
+        return None
+    try:
+        number = float(value)
+    except OverflowError:
+        # An int past the float range
+        return None
+    # JSON NaN and Infinity, and numbers that overflow to inf such as 1e400
+    return number if math.isfinite(number) else None
+
+def coerce_value(field_name, field_type, value):
+    """Convert a raw value into the (text_value, number_value) pair stored for a field"""
+    if value is None:
+        raise ValueError(f"Field {field_name} cannot be null")
+    if field_type == FieldType.TEXT:
+        return str(value), None
+    number = to_number(value)
+    if number is None:
+        raise ValueError(f"Invalid number value for field {field_name}")
+    return None, number
+
 # Association table for AssetType and AssetField
 asset_type_fields = db.Table('asset_type_fields',
     db.Column('asset_type_id', db.Integer, db.ForeignKey('asset_types.id'), primary_key=True),
@@ -44,6 +82,9 @@ class AssetValue(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     asset_id = db.Column(db.Integer, db.ForeignKey('assets.id'), nullable=False)
+    # Copy of the asset's type: the partition key of asset_values on PostgreSQL, and
+    # lets type-scoped queries skip joining assets
+    asset_type_id = db.Column(db.Integer, db.ForeignKey('asset_types.id'), nullable=False)
     field_id = db.Column(db.Integer, db.ForeignKey('asset_fields.id'), nullable=False)
     text_value = db.Column(db.String)
     number_value = db.Column(db.Float)
@@ -53,8 +94,19 @@ class AssetValue(db.Model):
     # Relationships
     field = db.relationship('AssetField')
     
-    # Ensure we don't have duplicate field values for the same asset
-    __table_args__ = (db.UniqueConstraint('asset_id', 'field_id', name='uq_asset_field_value'),)
+    # Ensure we don't have duplicate field values for the same asset, and let
+    # value filters run as index scans per field. Unique constraints of a
+    # partitioned table must include its partition key.
+    __table_args__ = (
+        db.UniqueConstraint('asset_type_id', 'asset_id', 'field_id', name='uq_asset_field_value'),
+        # Per-asset lookups (Asset.values, unscoped lists and exports), which the unique key cannot serve
+        db.Index('ix_asset_values_asset_id', 'asset_id', 'field_id'),
+        db.Index('ix_asset_values_field_id_number_value', 'field_id', 'number_value'),
+        db.Index('ix_asset_values_field_id_text_value', 'field_id', 'text_value'),
+        # Substring and prefix search on PostgreSQL, SQLite searches through asset_values_fts
+        db.Index('ix_asset_values_text_value_trgm', 'text_value', postgresql_using='gin',
+                 postgresql_ops={'text_value': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
 
     def get_value(self):
         """Get the value based on field type"""
@@ -65,12 +117,24 @@ class Asset(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     asset_type_id = db.Column(db.Integer, db.ForeignKey('asset_types.id'), nullable=False)
+    # Denormalized copy of the asset's values keyed by field name; asset_values
+    # stays the source of truth and this is only read when ASSET_DOCUMENT_READS is on
+    document = db.Column(db.JSON().with_variant(JSONB(), 'postgresql'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     asset_type = db.relationship('AssetType', backref=db.backref('assets', lazy=True))
     values = db.relationship('AssetValue', backref='asset', cascade='all, delete-orphan')
+
+    # Serves keyset pagination within a type without scanning other types' rows
+    __table_args__ = (db.Index('ix_assets_asset_type_id_id', 'asset_type_id', 'id'),)
+
+    @staticmethod
+    def eager_load_options():
+        """Loader options that fetch the values of a batch of assets up front"""
+        # Field definitions come from the schema cache rather than asset_type.fields
+        return (selectinload(Asset.values),)
     
     def get_value(self, field_name):
         """Get the value of a specific field by name"""
@@ -79,8 +143,11 @@ class Asset(db.Model):
                 return value.text_value if value.field.field_type == FieldType.TEXT else value.number_value
         return None
         
-    def get_all_fields_with_values(self):
+    def get_all_fields_with_values(self, schema=None):
         """Get all fields from the asset type with their current values"""
+        if schema is not None:
+            # Resolve fields by id from a cached schema instead of lazy loading them
+            return schema.data((value.field_id, value.text_value, value.number_value) for value in self.values)
         result = {}
         # First, add all fields with None values
         for field in self.asset_type.fields:
@@ -90,6 +157,15 @@ class Asset(db.Model):
             result[value.field.name] = value.get_value()
         return result
     
+    def get_document_values(self, schema):
+        """Get all fields from the asset type with their values read from the document column"""
+        return schema.document_data(self.document)
+
+    def build_document(self, schema):
+        """Build the document column contents from the asset's current values"""
+        data = self.get_all_fields_with_values(schema)
+        return {name: value for name, value in data.items() if value is not None}
+    
     def set_value(self, field_name, value):
         """Set the value for a specific field by name"""
         # Find the field in the asset type's fields
@@ -104,12 +180,82 @@ class Asset(db.Model):
             self.values.append(asset_value)
         
         # Set the appropriate value based on field type
-        if field.field_type == FieldType.TEXT:
-            asset_value.text_value = str(value)
-            asset_value.number_value = None
-        else:  # NUMBER
-            try:
-                asset_value.number_value = float(value)
-                asset_value.text_value = None
-            except (ValueError, TypeError):
-                raise ValueError(f"Invalid number value for field {field_name}")
+        asset_value.text_value, asset_value.number_value = coerce_value(field_name, field.field_type, value)
+
+class AssetChange(db.Model):
+    """One entry of the append-only log of asset and asset type changes, written in the changing transaction"""
+    __tablename__ = 'asset_changes'
+
+    # BIGINT on PostgreSQL, SQLite only autoincrements an INTEGER primary key
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    asset_type_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(20), nullable=False)
+    # Values written by the change, keyed by field name
+    data = db.Column(db.JSON().with_variant(JSONB(), 'postgresql'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Serves the feed of a single type
+    __table_args__ = (db.Index('ix_asset_changes_asset_type_id_seq', 'asset_type_id', 'seq'),)
+
+class JobStatus(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+class Job(db.Model):
+    """A long operation run by `flask jobs-worker` in chunked transactions"""
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    params = db.Column(db.JSON, nullable=False)
+    # Where the next chunk starts, committed together with the chunk so a reclaimed job resumes there
+    checkpoint = db.Column(db.Integer)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(100))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Workers look for the oldest claimable job
+    __table_args__ = (db.Index('ix_jobs_status_id', 'status', 'id'),)
+
+@event.listens_for(AssetValue, 'before_insert')
+def fill_asset_type_id(mapper, connection, target):
+    """Copy the asset's type into values added through the ORM, bulk inserts set it themselves"""
+    if target.asset_type_id is None:
+        if target.asset is not None:
+            target.asset_type_id = target.asset.asset_type_id
+        else:
+            target.asset_type_id = connection.scalar(
+                db.select(Asset.asset_type_id).where(Asset.id == target.asset_id)
+            )
+
+# Search index of text values on SQLite: an external content FTS5 table with the
+# trigram tokenizer, kept in sync with asset_values by triggers
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS asset_values_fts USING fts5("
+    "text_value, content='asset_values', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS asset_values_fts_insert AFTER INSERT ON asset_values BEGIN "
+    "INSERT INTO asset_values_fts(rowid, text_value) VALUES (new.id, new.text_value); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_values_fts_delete AFTER DELETE ON asset_values BEGIN "
+    "INSERT INTO asset_values_fts(asset_values_fts, rowid, text_value) VALUES ('delete', old.id, old.text_value); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_values_fts_update AFTER UPDATE OF text_value ON asset_values BEGIN "
+    "INSERT INTO asset_values_fts(asset_values_fts, rowid, text_value) VALUES ('delete', old.id, old.text_value); "
+    "INSERT INTO asset_values_fts(rowid, text_value) VALUES (new.id, new.text_value); END",
+]
+
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(AssetValue.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(AssetValue.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS asset_values_fts').execute_if(dialect='sqlite'))
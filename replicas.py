@@ -0,0 +1,64 @@
+import random
+import time
+from functools import wraps
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Delete, Insert, Update
+
+READ_METHODS = ('GET', 'HEAD')
+# Holds the time until which a client that just wrote reads from the primary
+PRIMARY_COOKIE = 'db_primary_until'
+
+class RoutingSession(Session):
+    """Session that runs the reads of GET requests on the replica picked for the request
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary, as does
+    everything outside a routed request (CLI commands, non-GET requests).
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('_db_replica')
+        if bind is None and replica and not self._flushing and not isinstance(clause, (Insert, Update, Delete)):
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_from_primary(f):
+    """Keep a GET view on the primary, for reads that must not lag behind commits"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g._db_replica = None
+        return f(*args, **kwargs)
+    return decorated
+
+class ReplicaRouter:
+    """Routes GET requests to one of the replica binds, except shortly after the client wrote"""
+    def __init__(self):
+        self.keys = []
+        self.window = 5
+
+    def init_app(self, app):
+        self.keys = [key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith('replica_')]
+        self.window = app.config['REPLICA_READ_YOUR_WRITES_SECONDS']
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(RoutingSession, 'after_commit', self._after_commit)
+
+    def _before_request(self):
+        g._db_replica = None
+        if not self.keys or request.method not in READ_METHODS:
+            return
+        # Replicas may not have this client's last writes yet
+        if request.cookies.get(PRIMARY_COOKIE, 0, type=float) > time.time():
+            return
+        g._db_replica = random.choice(self.keys)
+
+    def _after_commit(self, session):
+        if has_request_context() and request.method not in READ_METHODS:
+            g._db_wrote = True
+
+    def _after_request(self, response):
+        if self.keys and g.pop('_db_wrote', False):
+            response.set_cookie(PRIMARY_COOKIE, str(time.time() + self.window), max_age=self.window, httponly=True)
+        return response
+
+replicas = ReplicaRouter()
@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, g, request
+from flask_restx.utils import unpack
+
+class MemoryBackend:
+    """In-process LRU backend, entries are only shared by the threads of one worker"""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._tags = defaultdict(set)
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            body, expires, _ = entry
+            if expires <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body, ttl, tags):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (body, time.monotonic() + ttl, tags)
+            for tag in tags:
+                self._tags[tag].add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._discard(key)
+
+    def version(self, name):
+        with self._lock:
+            return self._versions[name]
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[2]:
+                keys = self._tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tags[tag]
+
+class RedisBackend:
+    """Backend on a Redis protocol server, shared by every worker
+
+    Each tag is a set of the keys cached under it, so invalidating a tag deletes
+    exactly the entries that depend on it.
+    """
+    def __init__(self, client, prefix='asset-api:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, key):
+        return f'{self.prefix}response:{key}'
+
+    def _tag(self, tag):
+        return f'{self.prefix}tag:{tag}'
+
+    def _version(self, name):
+        return f'{self.prefix}version:{name}'
+
+    def get(self, key):
+        return self.client.get(self._key(key))
+
+    def set(self, key, body, ttl, tags):
+        pipe = self.client.pipeline()
+        pipe.set(self._key(key), body, ex=ttl)
+        for tag in tags:
+            pipe.sadd(self._tag(tag), self._key(key))
+            pipe.expire(self._tag(tag), ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        tag_keys = [self._tag(tag) for tag in tags]
+        keys = self.client.sunion(tag_keys)
+        self.client.delete(*keys, *tag_keys)
+
+    def version(self, name):
+        return int(self.client.get(self._version(name)) or 0)
+
+    def bump(self, name):
+        # Never expires, a counter starting over could match a version cached before
+        self.client.incr(self._version(name))
+
+    def clear(self):
+        # Cached responses only, versions keep counting
+        keys = [*self.client.scan_iter(match=self._key('*')), *self.client.scan_iter(match=self._tag('*'))]
+        if keys:
+            self.client.delete(*keys)
+
+class ResponseCache:
+    """Caches JSON bodies of read endpoints, keyed by path and query args and invalidated by tag"""
+    def __init__(self):
+        self.backend = None
+        self.ttl = 300
+
+    def init_app(self, app):
+        backend = app.config['RESPONSE_CACHE_BACKEND']
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['RESPONSE_CACHE_SIZE'])
+        elif backend == 'redis':
+            self.backend = RedisBackend.from_url(app.config['RESPONSE_CACHE_URL'])
+        elif backend not in (None, '', 'none'):
+            raise ValueError(f"Unknown response cache backend {backend}")
+
+    def cached(self, tags):
+        """Cache a view's 200 responses; tags(data, **view_args) names what invalidates them
+
+        Under routes.conditional the key includes the ETag computed before the view
+        ran. A body read after a concurrent write and its invalidation is then stored
+        under the older version, which later requests no longer look up.
+        """
+        # Imported here: serializers imports api, which imports the service layer that imports this module
+        from serializers import dumps
+
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if self.backend is None:
+                    return f(*args, **kwargs)
+                key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+                if g.get('response_etag'):
+                    key += '#' + g.response_etag
+                body = self.backend.get(key)
+                if body is not None:
+                    return current_app.response_class(body, mimetype='application/json', headers={'X-Cache': 'HIT'})
+
+                data, code, headers = unpack(f(*args, **kwargs))
+                if code != 200:
+                    return data, code, headers
+                body = dumps(data)
+                self.backend.set(key, body, self.ttl, tags(data, **kwargs))
+                headers = dict(headers, **{'X-Cache': 'MISS'})
+                return current_app.response_class(body, status=code, mimetype='application/json', headers=headers)
+            return decorated
+        return decorator
+
+    def invalidate(self, *tags):
+        """Drop every cached response tagged with any of tags"""
+        if self.backend is not None and tags:
+            self.backend.invalidate(tags)
+
+    def version(self, name):
+        """Current value of a counter shared like the cached responses, None without a backend"""
+        if self.backend is not None:
+            return self.backend.version(name)
+        return None
+
+    def bump(self, name):
+        """Increment a version counter, telling every process that what it names changed"""
+        if self.backend is not None:
+            self.backend.bump(name)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+response_cache = ResponseCache()
@@ -1,28 +1,176 @@
-from flask import request
-from flask_restx import Resource
-from app import require_api_key
-from models import FieldType
-from service import AssetTypeService, AssetService
+import csv
+import hashlib
+import io
+import queue
+import re
+from datetime import datetime
+from functools import wraps
+from flask import Response, current_app, g, request, stream_with_context
+from flask_restx import Resource, marshal
+from flask_restx.utils import unpack
+from werkzeug.http import http_date, quote_etag
+from app import db, require_api_key
+from columnar import COLUMNAR_FORMATS, export_chunks, pa
+from events import StreamLimitReached, asset_event, broker
+from metrics import metrics
+from replicas import read_from_primary
+from models import FieldType, ValidationError
+from response_cache import response_cache
+from schema_cache import schema_cache
+from serializers import serialize, dumps
+from jobs import JobService
+from service import (
+    AssetTypeService, AssetService, ChangeService,
+    DEFAULT_PAGE_SIZE, EXPORT_BATCH_SIZE, COLUMNAR_BATCH_SIZE, BULK_MAX_ITEMS
+)
 from api import (
-    api, asset_ns, assets_ns,
-    asset_type, asset_type_input,
-    asset_field, asset_field_input,
-    asset, asset_data
+    api, asset_ns, assets_ns, jobs_ns, changes_ns,
+    asset_type, asset_type_input, asset_type_page,
+    asset_field, asset_field_input, asset_type_stats,
+    asset, asset_data, asset_page, search_page,
+    asset_bulk_input, asset_bulk_result, asset_bulk_patch_input, asset_bulk_patch_result,
+    job, job_input, asset_change, asset_change_page,
+    pagination_args, stats_args, search_args, changes_args, events_args
 )
 
+FILTER_ARG = re.compile(r'^filter\[([^\]]+)\](?:\[(\w+)\])?$')
+
+def parse_filters(args):
+    """Collect filter[<field>]=value and filter[<field>][<op>]=value from (key, value) pairs as (field, op, value)"""
+    filters = []
+    for key, value in args:
+        match = FILTER_ARG.match(key)
+        if match:
+            filters.append((match.group(1), match.group(2) or 'eq', value))
+    return filters
+
+def _validators(version):
+    """ETag and Last-Modified of the representation at this URL for a resource version tuple"""
+    etag = hashlib.sha1(repr((request.path, request.query_string, version)).encode()).hexdigest()
+    timestamps = [value for value in version if isinstance(value, datetime)]
+    return etag, max(timestamps) if timestamps else None
+
+def _validator_headers(etag, last_modified):
+    headers = {'ETag': quote_etag(etag)}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def _not_modified(etag, last_modified):
+    """Whether the client's cached copy, per If-None-Match or If-Modified-Since, is still current"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        # HTTP dates only have second precision
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+def conditional(version):
+    """Tag GET responses with ETag/Last-Modified and answer 304 without building the body when unchanged
+
+    version is called with the view arguments and returns a tuple that changes whenever
+    the representation does, such as counts and updated_at timestamps.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            try:
+                etag, last_modified = _validators(version(**kwargs))
+            except ValueError as e:
+                api.abort(400, str(e))
+            # Part of the response cache key, so a body is only ever served under its own version
+            g.response_etag = etag
+            headers = _validator_headers(etag, last_modified)
+            if _not_modified(etag, last_modified):
+                return Response(status=304, headers=headers)
+            rv = f(*args, **kwargs)
+            if isinstance(rv, Response):
+                rv.headers.update(headers)
+                return rv
+            data, code, extra = unpack(rv)
+            return data, code, dict(extra, **headers)
+        return decorated
+    return decorator
+
+def _asset_list_version():
+    asset_type_id = request.args.get('asset_type_id', type=int)
+    filters = parse_filters(request.args.items(multi=True))
+    args = pagination_args.parse_args()
+    if not _is_paginated(args):
+        return AssetService.get_assets_version(asset_type_id, filters)
+    return AssetService.get_assets_version(
+        asset_type_id, filters, limit=args['limit'] or DEFAULT_PAGE_SIZE, after=args['after']
+    )
+
+def _asset_search_version():
+    # A search reads every value of the type, versioning the type's assets costs less than that
+    return AssetService.get_assets_version(request.args.get('asset_type_id', type=int))
+
+def _asset_list_tags(data):
+    asset_type_id = request.args.get('asset_type_id', type=int)
+    # Asset data lists every field of its type, so schema changes invalidate lists too
+    return ['assets', f'asset_type:{asset_type_id}' if asset_type_id else 'asset_types']
+
+def _is_paginated(args):
+    """Whether the client asked for a keyset page rather than the full list"""
+    return args['limit'] is not None or args['after'] is not None
+
+def _chunked(lines, size=EXPORT_BATCH_SIZE):
+    """Join lines into chunks of size lines so a stream is not flushed once per row"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+def _ndjson_lines(assets):
+    for item in assets:
+        yield dumps(item).decode() + '\n'
+
+def _csv_lines(assets, schema):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow(row)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    field_names = list(schema.fields)
+    yield line(['id', 'asset_type_id'] + field_names)
+    for item in assets:
+        data = item['data']
+        yield line([item['id'], item['asset_type_id']] + [data.get(name) for name in field_names])
+
 @asset_ns.route('/')
 class AssetTypeList(Resource):
     method_decorators = [require_api_key]
     @asset_ns.doc('list_asset_types')
-    @asset_ns.marshal_list_with(asset_type)
+    @asset_ns.expect(pagination_args)
+    @asset_ns.response(200, 'Success', asset_type_page)
+    @conditional(lambda: AssetTypeService.get_asset_types_version())
+    @response_cache.cached(lambda data: ['asset_types'])
     def get(self):
-        """List all asset types"""
-        return AssetTypeService.get_all_asset_types()
+        """List asset types, as a keyset page when limit or after is given"""
+        args = pagination_args.parse_args()
+        if not _is_paginated(args):
+            asset_types = AssetTypeService.get_all_asset_types()
+            with metrics.serializing():
+                return serialize(asset_types, asset_type)
+        limit = args['limit'] or DEFAULT_PAGE_SIZE
+        items, next_cursor = AssetTypeService.get_asset_types_page(limit=limit, after=args['after'])
+        with metrics.serializing():
+            return {'items': serialize(items, asset_type), 'limit': limit, 'next_cursor': next_cursor}
 
     @asset_ns.doc('create_asset_type')
     @asset_ns.expect(asset_type_input)
     @asset_ns.response(201, 'Asset type created successfully')
-    @asset_ns.marshal_with(asset_type, code=201)
+    @metrics.serialized(asset_ns.marshal_with(asset_type, code=201))
     def post(self):
         """Create a new asset type"""
         data = api.payload
@@ -36,24 +184,32 @@ class AssetTypeList(Resource):
 class AssetTypeItem(Resource):
     method_decorators = [require_api_key]
     @asset_ns.doc('get_asset_type')
-    @asset_ns.marshal_with(asset_type)
+    @conditional(lambda type_id: (AssetTypeService.get_asset_type_version(type_id),))
+    @asset_ns.response(200, 'Success', asset_type)
+    @response_cache.cached(lambda data, type_id: [f'asset_type:{type_id}'])
     def get(self, type_id):
         """Get a specific asset type"""
-        return AssetTypeService.get_asset_type(type_id)
+        found = AssetTypeService.get_asset_type(type_id)
+        with metrics.serializing():
+            return serialize(found, asset_type)
 
 @asset_ns.route('/<int:type_id>/fields/')
 class AssetTypeFields(Resource):
     method_decorators = [require_api_key]
     @asset_ns.doc('get_asset_type_fields')
-    @asset_ns.marshal_list_with(asset_field)
+    @conditional(lambda type_id: (AssetTypeService.get_asset_type_version(type_id),))
+    @asset_ns.response(200, 'Success', [asset_field])
+    @response_cache.cached(lambda data, type_id: [f'asset_type:{type_id}'])
     def get(self, type_id):
         """Get fields for an asset type"""
-        return AssetTypeService.get_asset_type_fields(type_id)
+        type_fields = AssetTypeService.get_asset_type_fields(type_id)
+        with metrics.serializing():
+            return serialize(type_fields, asset_field)
 
     @asset_ns.doc('add_field_to_asset_type')
     @asset_ns.expect(asset_field_input)
     @asset_ns.response(201, 'Field added successfully')
-    @asset_ns.marshal_with(asset_field, code=201)
+    @metrics.serialized(asset_ns.marshal_with(asset_field, code=201))
     def post(self, type_id):
         """Add a field to an asset type"""
         data = api.payload
@@ -67,20 +223,53 @@ class AssetTypeFields(Resource):
         except ValueError as e:
             api.abort(400, str(e))
 
+@asset_ns.route('/<int:type_id>/stats/')
+class AssetTypeStats(Resource):
+    method_decorators = [require_api_key]
+    @asset_ns.doc('get_asset_type_stats')
+    @asset_ns.expect(stats_args)
+    @asset_ns.response(200, 'Success', asset_type_stats)
+    @conditional(lambda type_id: AssetService.get_assets_version(type_id))
+    @response_cache.cached(lambda data, type_id: ['assets', f'asset_type:{type_id}'])
+    def get(self, type_id):
+        """Get count, sum, min, max, avg and histograms of the NUMBER fields of a type's assets"""
+        args = stats_args.parse_args()
+        try:
+            return AssetTypeService.get_stats(type_id, args['buckets'], args['group_by'], args['limit'])
+        except ValueError as e:
+            api.abort(400, str(e))
+
 @assets_ns.route('/')
 class AssetList(Resource):
     method_decorators = [require_api_key]
-    @assets_ns.doc('list_assets')
-    @assets_ns.marshal_list_with(asset)
+    @assets_ns.doc('list_assets', params={
+        'filter[<field>][<op>]': 'Only assets whose <field> value matches, op is one of eq (default), ne, lt, lte, gt, gte'
+    })
+    @assets_ns.expect(pagination_args)
+    @assets_ns.response(200, 'Success', asset_page)
+    @conditional(_asset_list_version)
+    @response_cache.cached(_asset_list_tags)
     def get(self):
-        """List all assets"""
+        """List assets, as a keyset page when limit or after is given"""
         asset_type_id = request.args.get('asset_type_id', type=int)
-        return AssetService.get_all_assets(asset_type_id)
+        filters = parse_filters(request.args.items(multi=True))
+        args = pagination_args.parse_args()
+        try:
+            if not _is_paginated(args):
+                assets, _ = AssetService.get_asset_rows(asset_type_id, filters)
+                return assets
+            limit = args['limit'] or DEFAULT_PAGE_SIZE
+            items, next_cursor = AssetService.get_asset_rows(
+                asset_type_id, filters, limit=limit, after=args['after']
+            )
+        except ValueError as e:
+            api.abort(400, str(e))
+        return {'items': items, 'limit': limit, 'next_cursor': next_cursor}
 
     @assets_ns.doc('create_asset')
     @assets_ns.expect(asset_data)
     @assets_ns.response(201, 'Asset created successfully')
-    @assets_ns.marshal_with(asset, code=201)
+    @metrics.serialized(assets_ns.marshal_with(asset, code=201))
     def post(self):
         """Create a new asset"""
         data = api.payload
@@ -90,29 +279,240 @@ class AssetList(Resource):
                 field_values=data['data']
             )
             return new_asset, 201
+        except ValidationError as e:
+            api.abort(400, str(e), errors=e.errors)
         except ValueError as e:
             api.abort(400, str(e))
 
+    @assets_ns.doc('bulk_update_assets')
+    @assets_ns.expect(asset_bulk_patch_input)
+    @assets_ns.response(200, 'Assets updated, invalid records are reported in errors', asset_bulk_patch_result)
+    @assets_ns.response(400, 'No record could be updated', asset_bulk_patch_result)
+    def patch(self):
+        """Update the values of many assets in one transaction"""
+        records = api.payload.get('assets')
+        if not isinstance(records, list):
+            api.abort(400, 'assets must be a list')
+        if len(records) > BULK_MAX_ITEMS:
+            api.abort(400, f'At most {BULK_MAX_ITEMS} assets can be updated per request')
+
+        updated, errors = AssetService.bulk_update_assets(records)
+        status = 400 if errors and not updated else 200
+        with metrics.serializing():
+            return marshal({'updated': updated, 'errors': errors}, asset_bulk_patch_result), status
+
+@assets_ns.route('/search/')
+class AssetSearch(Resource):
+    method_decorators = [require_api_key]
+    @assets_ns.doc('search_assets')
+    @assets_ns.expect(search_args)
+    @assets_ns.response(200, 'Success', search_page)
+    @conditional(_asset_search_version)
+    @response_cache.cached(_asset_list_tags)
+    def get(self):
+        """Find the assets of a type by substring or prefix of their TEXT values, best matches first"""
+        args = search_args.parse_args()
+        try:
+            items, next_offset = AssetService.search_assets(
+                args['q'], args['asset_type_id'], args['fields'], args['mode'], args['limit'], args['offset']
+            )
+        except ValueError as e:
+            api.abort(400, str(e))
+        return {'items': items, 'limit': args['limit'], 'offset': args['offset'], 'next_offset': next_offset}
+
+def _sse_message(e):
+    return f"id: {e['seq']}\nevent: {e['op']}\ndata: {dumps(e).decode()}\n\n"
+
+def _event_stream(subscription, since=None):
+    """Replay the change log after since, then relay live events until the client leaves or falls behind"""
+    try:
+        # Sent right away so clients and proxies see the stream open
+        yield ': connected\n\n'
+        if since is not None:
+            while True:
+                changes, next_since = ChangeService.get_changes(since, EXPORT_BATCH_SIZE, subscription.asset_type_id)
+                for change in changes:
+                    e = asset_event(change.seq, change.entity_id, change.asset_type_id, change.op, change.data)
+                    if change.entity == 'asset' and subscription.matches(e):
+                        yield _sse_message(e)
+                since = next_since
+                if len(changes) < EXPORT_BATCH_SIZE:
+                    break
+        # Waiting on the queue needs no database connection
+        db.session.remove()
+
+        heartbeat = current_app.config['EVENTS_HEARTBEAT_SECONDS']
+        while not subscription.overflowed:
+            try:
+                e = subscription.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            # The first live events may have been replayed already
+            if since is None or e['seq'] > since:
+                yield _sse_message(e)
+    finally:
+        broker.unsubscribe(subscription)
+
+@assets_ns.route('/events/')
+class AssetEvents(Resource):
+    # The replay must see every change committed before the live events it is followed by
+    method_decorators = [require_api_key, read_from_primary]
+    @assets_ns.doc('stream_asset_events')
+    @assets_ns.expect(events_args)
+    @assets_ns.response(200, 'text/event-stream of create and update events, the event id is the change sequence number')
+    @assets_ns.response(503, 'This worker already serves EVENTS_MAX_STREAMS streams')
+    def get(self):
+        """Stream asset create and update events as Server-Sent Events"""
+        args = events_args.parse_args()
+        since = request.headers.get('Last-Event-ID', args['since'], type=int)
+        # Subscribed before the replay so nothing committed meanwhile is missed
+        try:
+            subscription = broker.subscribe(args['asset_type_id'], args['ids'], stream=True)
+        except StreamLimitReached:
+            api.abort(503, 'Too many open event streams, retry later')
+        response = Response(
+            stream_with_context(_event_stream(subscription, since)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        # Also when the client left before the stream started
+        response.call_on_close(lambda: broker.unsubscribe(subscription))
+        return response
+
+@assets_ns.route('/bulk/')
+class AssetBulk(Resource):
+    method_decorators = [require_api_key]
+    @assets_ns.doc('bulk_create_assets')
+    @assets_ns.expect(asset_bulk_input)
+    @assets_ns.response(201, 'Assets created, invalid records are reported in errors', asset_bulk_result)
+    @assets_ns.response(400, 'No record could be created', asset_bulk_result)
+    def post(self):
+        """Create many assets in one transaction"""
+        records = api.payload.get('assets')
+        if not isinstance(records, list):
+            api.abort(400, 'assets must be a list')
+        if len(records) > BULK_MAX_ITEMS:
+            api.abort(400, f'At most {BULK_MAX_ITEMS} assets can be created per request')
+
+        created, errors = AssetService.bulk_create_assets(records)
+        status = 400 if errors and not created else 201
+        with metrics.serializing():
+            return marshal({'created': created, 'errors': errors}, asset_bulk_result), status
+
 @assets_ns.route('/<int:asset_id>/')
 class AssetItem(Resource):
     method_decorators = [require_api_key]
     @assets_ns.doc('get_asset')
-    @assets_ns.marshal_with(asset)
+    @conditional(lambda asset_id: AssetService.get_asset_version(asset_id))
+    @assets_ns.response(200, 'Success', asset)
+    @response_cache.cached(lambda data, asset_id: [f'asset:{asset_id}', f'asset_type:{data["asset_type_id"]}'])
     def get(self, asset_id):
         """Get a specific asset"""
-        return AssetService.get_asset(asset_id)
+        found = AssetService.get_asset(asset_id)
+        with metrics.serializing():
+            return serialize(found, asset)
 
     @assets_ns.doc('update_asset')
     @assets_ns.expect(asset_data)
-    @assets_ns.marshal_with(asset)
+    @assets_ns.response(412, 'The asset changed since the ETag sent in If-Match')
+    @metrics.serialized(assets_ns.marshal_with(asset))
     def put(self, asset_id):
-        """Update an asset"""
+        """Update an asset, only if it still matches If-Match when that header is sent"""
         data = api.payload
+        if request.if_match:
+            # The row stays locked until update_asset commits, so the check cannot race a concurrent write
+            etag, _ = _validators(AssetService.get_asset_version(asset_id, for_update=True))
+            if not request.if_match.contains(etag):
+                api.abort(412, 'Asset was modified since it was fetched')
         try:
             updated_asset = AssetService.update_asset(
                 asset_id=asset_id,
                 field_values=data['data']
             )
-            return updated_asset
+        except ValidationError as e:
+            api.abort(400, str(e), errors=e.errors)
         except ValueError as e:
             api.abort(400, str(e))
+        return updated_asset, 200, _validator_headers(*_validators(AssetService.get_asset_version(asset_id)))
+
+@assets_ns.route('/export/')
+class AssetExport(Resource):
+    method_decorators = [require_api_key]
+    @assets_ns.doc('export_assets', params={
+        'asset_type_id': 'Only export assets of this type (required for csv, arrow and parquet)',
+        'format': 'ndjson (default), csv, arrow (IPC stream) or parquet'
+    })
+    @assets_ns.response(200, 'Stream of assets, one per line, or of Arrow record batches')
+    def get(self):
+        """Stream every asset as NDJSON, CSV, Arrow or Parquet without building the list in memory"""
+        asset_type_id = request.args.get('asset_type_id', type=int)
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv', *COLUMNAR_FORMATS):
+            api.abort(400, f'Unsupported export format {export_format}')
+
+        schema = None
+        if export_format != 'ndjson':
+            if not asset_type_id:
+                api.abort(400, f'asset_type_id is required for {export_format} exports')
+            schema = schema_cache.get(asset_type_id)
+            if schema is None:
+                api.abort(404, f'Asset type {asset_type_id} does not exist')
+
+        if export_format == 'ndjson':
+            chunks = _chunked(_ndjson_lines(AssetService.iter_asset_rows(asset_type_id)))
+            mimetype = 'application/x-ndjson'
+        elif export_format == 'csv':
+            chunks = _chunked(_csv_lines(AssetService.iter_asset_rows(asset_type_id), schema))
+            mimetype = 'text/csv'
+        else:
+            if pa is None:
+                api.abort(501, f'{export_format} exports need the pyarrow package')
+            batches = AssetService.iter_asset_row_batches(asset_type_id, COLUMNAR_BATCH_SIZE)
+            chunks = export_chunks(schema, batches, export_format)
+            mimetype = COLUMNAR_FORMATS[export_format]
+
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename=assets.{export_format}'}
+        )
+
+@jobs_ns.route('/')
+class JobList(Resource):
+    method_decorators = [require_api_key]
+    @jobs_ns.doc('submit_job')
+    @jobs_ns.expect(job_input)
+    @jobs_ns.response(202, 'Job queued, poll it until it succeeded or failed')
+    @metrics.serialized(jobs_ns.marshal_with(job, code=202))
+    def post(self):
+        """Queue a long operation for `flask jobs-worker`"""
+        data = api.payload
+        try:
+            return JobService.submit_job(data.get('kind'), data.get('params')), 202
+        except ValueError as e:
+            api.abort(400, str(e))
+
+@jobs_ns.route('/<int:job_id>/')
+class JobItem(Resource):
+    method_decorators = [require_api_key]
+    @jobs_ns.doc('get_job')
+    @jobs_ns.response(200, 'Success', job)
+    def get(self, job_id):
+        """Get a job's status and progress"""
+        found = JobService.get_job(job_id)
+        with metrics.serializing():
+            return serialize(found, job)
+
+@changes_ns.route('/')
+class ChangeList(Resource):
+    method_decorators = [require_api_key]
+    @changes_ns.doc('list_changes')
+    @changes_ns.expect(changes_args)
+    @changes_ns.response(200, 'Success', asset_change_page)
+    def get(self):
+        """List the changes logged after a sequence number, oldest first"""
+        args = changes_args.parse_args()
+        changes, next_since = ChangeService.get_changes(args['since'], args['limit'], args['asset_type_id'])
+        with metrics.serializing():
+            return {'items': serialize(changes, asset_change), 'next_since': next_since}
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from sqlalchemy import select
+from app import app, db
+from metrics import metrics
+from models import AssetType, AssetField, FieldType, ValidationError, asset_type_fields, to_number
+from response_cache import response_cache
+
+SchemaField = namedtuple('SchemaField', ['id', 'name', 'field_type'])
+
+class TypeSchema:
+    """Field definitions of one asset type, ordered by field id"""
+    def __init__(self, type_id, fields):
+        self.type_id = type_id
+        self.fields = OrderedDict((field.name, field) for field in fields)
+        self.by_id = {field.id: field for field in fields}
+        # field name -> (field id, is text), the validator of the type's data
+        self._validators = {field.name: (field.id, field.field_type == FieldType.TEXT) for field in fields}
+        # The same, by field id, for pivoting stored values
+        self._columns = {field_id: (name, is_text) for name, (field_id, is_text) in self._validators.items()}
+        # Data dict of an asset without values, copied for every payload of the type
+        self._template = dict.fromkeys(self.fields)
+
+    def value_rows(self, data):
+        """Validate an asset's data dict and return the asset_values columns for it
+
+        Checks every value before failing, and raises one ValidationError that
+        lists each unknown field and invalid value.
+        """
+        if not isinstance(data, dict):
+            raise ValidationError([{'field': None, 'message': "Asset data must be an object"}])
+        validators = self._validators
+        rows, errors = [], []
+        for name, value in data.items():
+            validator = validators.get(name)
+            if validator is None:
+                errors.append({'field': name, 'message': f"Field {name} is not defined for this asset type"})
+            elif value is None:
+                errors.append({'field': name, 'message': f"Field {name} cannot be null"})
+            elif validator[1]:
+                rows.append({'field_id': validator[0], 'text_value': str(value), 'number_value': None})
+            else:
+                number = to_number(value)
+                if number is None:
+                    errors.append({'field': name, 'message': f"Invalid number value for field {name}"})
+                else:
+                    rows.append({'field_id': validator[0], 'text_value': None, 'number_value': number})
+        if errors:
+            raise ValidationError(errors)
+        return rows
+
+    def data(self, values):
+        """Build an asset's data dict, with every field of the type, from (field_id, text_value, number_value) tuples"""
+        data = self._template.copy()
+        columns = self._columns
+        for field_id, text_value, number_value in values:
+            column = columns.get(field_id)
+            if column is not None:
+                data[column[0]] = text_value if column[1] else number_value
+        return data
+
+    def document_data(self, document):
+        """Build an asset's data dict, with every field of the type, from its document column"""
+        data = self._template.copy()
+        data.update((name, value) for name, value in document.items() if name in data)
+        return data
+
+def schema_query(type_id):
+    """Select (type id, field id, name, field type) rows of an asset type, one row even without fields"""
+    return (
+        select(AssetType.id, AssetField.id, AssetField.name, AssetField.field_type)
+        .outerjoin(asset_type_fields, asset_type_fields.c.asset_type_id == AssetType.id)
+        .outerjoin(AssetField, AssetField.id == asset_type_fields.c.asset_field_id)
+        .where(AssetType.id == type_id)
+        .order_by(AssetField.id)
+    )
+
+def build_schema(type_id, rows):
+    """Build a TypeSchema from schema_query rows, None if the type does not exist"""
+    if not rows:
+        return None
+    return TypeSchema(type_id, [
+        SchemaField(field_id, name, field_type)
+        for _, field_id, name, field_type in rows if field_id is not None
+    ])
+
+def load_schema(type_id):
+    """Read an asset type's fields from the database, None if the type does not exist"""
+    # From the primary, a lagging replica would cache an older schema under the current version
+    rows = db.session.execute(schema_query(type_id), bind_arguments={'bind': db.engine}).all()
+    return build_schema(type_id, rows)
+
+def schema_version(type_id):
+    return f'schema:{type_id}'
+
+class SchemaCache:
+    """Bounded LRU cache of asset type id -> TypeSchema
+
+    Each entry holds the type's version counter in the response cache backend as
+    read before the schema was loaded. Invalidating a type bumps the counter, so
+    with a shared backend every worker drops its entry on the next lookup.
+    Without a backend only the worker that changed the type does, and entries of
+    the others expire after ttl seconds.
+    """
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, type_id):
+        """Return (cached schema or None on a miss, version to store a freshly loaded schema under)"""
+        version = response_cache.version(schema_version(type_id))
+        with self._lock:
+            entry = self._entries.get(type_id)
+            if entry is not None and entry[1] > time.monotonic() and entry[2] == version:
+                self._entries.move_to_end(type_id)
+                self.hits += 1
+                return entry[0], version
+            self._entries.pop(type_id, None)
+            self.misses += 1
+            return None, version
+
+    def store(self, type_id, schema, version):
+        """Cache a schema, evicting the least recently used entry when full"""
+        with self._lock:
+            self._entries[type_id] = (schema, time.monotonic() + self.ttl, version)
+            self._entries.move_to_end(type_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return schema
+
+    def get(self, type_id):
+        """Return a type's schema, loading it from the database on a miss"""
+        schema, version = self.lookup(type_id)
+        if schema is None:
+            schema = load_schema(type_id)
+            if schema is not None:
+                self.store(type_id, schema, version)
+        return schema
+
+    def invalidate(self, type_id):
+        """Drop a type's schema after its fields changed, in every worker sharing the backend"""
+        with self._lock:
+            self._entries.pop(type_id, None)
+        response_cache.bump(schema_version(type_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+schema_cache = SchemaCache(maxsize=app.config['SCHEMA_CACHE_SIZE'], ttl=app.config['SCHEMA_CACHE_TTL'])
+metrics.register('schema_cache_hits_total', 'Asset type schemas served from the cache',
+                 lambda: schema_cache.hits, kind='counter')
+metrics.register('schema_cache_misses_total', 'Asset type schemas loaded from the database',
+                 lambda: schema_cache.misses, kind='counter')
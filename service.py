@@ -1,11 +1,381 @@
+import operator
+from datetime import datetime
+from itertools import chain, groupby
+from flask import abort, current_app
+from sqlalchemy import Float, Integer, and_, case, cast, column, delete, func, insert, literal, null, select, table, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased, selectinload
 from app import db
-from models import AssetType, Asset, AssetField, FieldType
+from events import broker
+from models import AssetType, Asset, AssetChange, AssetField, AssetValue, FieldType, ValidationError, coerce_value
+from response_cache import response_cache
+from schema_cache import schema_cache
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+# Rows per Arrow record batch and Parquet row group of columnar exports
+COLUMNAR_BATCH_SIZE = 10000
+BULK_MAX_ITEMS = 10000
+DEFAULT_CHANGES_PAGE_SIZE = 100
+# Key of the PostgreSQL advisory lock taken before appending to the change log
+CHANGE_LOG_LOCK = 0x61737365
+DEFAULT_HISTOGRAM_BUCKETS = 10
+DEFAULT_STATS_GROUPS = 20
+SEARCH_MODES = ('substring', 'prefix')
+# Shortest query the trigram indexes can serve, shorter ones scan the type's text values
+MIN_INDEXED_SEARCH = 3
+
+FILTER_OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+
+def paginate(query, column, limit, after=None):
+    """Return one keyset page of a query ordered by column, plus the cursor of the next page"""
+    if after is not None:
+        query = query.filter(column > after)
+    items = query.order_by(column).limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = getattr(items[-1], column.key)
+    return items, next_cursor
+
+def value_predicates(filters, fields, asset_type_id=None):
+    """Build the WHERE clauses matching every (field name, operator, value) filter, given {name: AssetField}"""
+    predicates = []
+    for field_name, op, raw_value in filters:
+        field = fields.get(field_name)
+        if not field:
+            raise ValueError(f"Field {field_name} does not exist")
+        compare = FILTER_OPERATORS.get(op)
+        if not compare:
+            raise ValueError(f"Unsupported filter operator {op}")
+        text_value, number_value = coerce_value(field_name, field.field_type, raw_value)
+        if field.field_type == FieldType.TEXT:
+            predicate = compare(AssetValue.text_value, text_value)
+        else:
+            predicate = compare(AssetValue.number_value, number_value)
+        # Served by the (field_id, text_value) and (field_id, number_value) indexes
+        values = select(AssetValue.asset_id).where(AssetValue.field_id == field.id, predicate)
+        if asset_type_id:
+            values = values.where(AssetValue.asset_type_id == asset_type_id)
+        predicates.append(Asset.id.in_(values))
+    return predicates
+
+def filter_by_values(query, filters, asset_type_id=None):
+    """Restrict an asset query to assets whose values match every (field name, operator, value) predicate"""
+    if not filters:
+        return query
+    names = {name for name, _, _ in filters}
+    fields = {f.name: f for f in AssetField.query.filter(AssetField.name.in_(names))}
+    return query.filter(*value_predicates(filters, fields, asset_type_id))
+
+def asset_page_query(asset_type_id=None, limit=None, after=None):
+    """Select (id, asset_type_id, document) of the assets of one page, before value filters are applied"""
+    page = select(Asset.id, Asset.asset_type_id, Asset.document)
+    if asset_type_id:
+        page = page.where(Asset.asset_type_id == asset_type_id)
+    if after is not None:
+        page = page.where(Asset.id > after)
+    if limit is not None:
+        page = page.order_by(Asset.id).limit(limit + 1)
+    return page
+
+def asset_rows_query(page, document_reads=False, asset_type_id=None):
+    """Select (asset id, type id, document, field id, text value, number value) rows for a page query
+
+    Pass the asset_type_id the page is restricted to, if any, so PostgreSQL only
+    reads its partition of asset_values.
+    """
+    page = page.subquery()
+    join_on = AssetValue.asset_id == page.c.id
+    if asset_type_id:
+        join_on = and_(join_on, AssetValue.asset_type_id == asset_type_id)
+    document = null()
+    if document_reads:
+        # Values are only needed for assets written before the document column existed
+        join_on = and_(join_on, page.c.document.is_(None))
+        document = page.c.document
+    return (
+        select(page.c.id, page.c.asset_type_id, document,
+               AssetValue.field_id, AssetValue.text_value, AssetValue.number_value)
+        .outerjoin(AssetValue, join_on)
+        .order_by(page.c.id)
+    )
+
+def pivot_asset_rows(rows, schema_for, limit=None):
+    """Turn asset_rows_query rows into asset payloads, returning (assets, next_cursor)"""
+    schemas, assets = {}, []
+    for asset_id, group in groupby(rows, key=operator.itemgetter(0)):
+        first = next(group)
+        _, type_id, document, *_ = first
+        schema = schemas.get(type_id)
+        if schema is None:
+            schema = schemas[type_id] = schema_for(type_id)
+        if document is not None:
+            data = schema.document_data(document)
+        else:
+            # Assets without any values come back as one row of NULLs from the outer join
+            data = schema.data(row[3:] for row in chain([first], group) if row[3] is not None)
+        assets.append({'id': asset_id, 'asset_type_id': type_id, 'data': data})
+
+    next_cursor = None
+    if limit is not None and len(assets) > limit:
+        assets = assets[:limit]
+        next_cursor = assets[-1]['id']
+    return assets, next_cursor
+
+def read_options():
+    """Loader options for assets that are about to be serialized"""
+    if current_app.config['ASSET_DOCUMENT_READS']:
+        # Data comes from assets.document, loading the values would be wasted work
+        return ()
+    return Asset.eager_load_options()
+
+def document_for(schema, rows):
+    """Build the document column contents of a new asset from its asset_values rows"""
+    document = {}
+    for row in rows:
+        field = schema.by_id[row['field_id']]
+        document[field.name] = row['text_value'] if field.field_type == FieldType.TEXT else row['number_value']
+    return document
+
+# INSERT of each dialect in app.SUPPORTED_DATABASES, all of which support ON CONFLICT ... DO UPDATE
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+def upsert_statement(dialect):
+    """INSERT into asset_values that overwrites the values of (asset_id, field_id) pairs that already exist"""
+    # Against the table rather than the entity, so the rows go out as one executemany
+    stmt = UPSERT_INSERTS[dialect](AssetValue.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=[AssetValue.asset_type_id, AssetValue.asset_id, AssetValue.field_id],
+        set_={
+            'text_value': stmt.excluded.text_value,
+            'number_value': stmt.excluded.number_value,
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+
+def plan_updates(updates):
+    """Merge [(locked asset row, schema, value rows)] into (values to upsert, {asset id: document}, ids to rebuild)
+
+    Later updates of the same asset win. Assets written before the document column
+    existed have no document to merge into; they are listed for a rebuild from
+    asset_values once the upsert ran.
+    """
+    values, documents, rebuild = {}, {}, set()
+    for current, schema, rows in updates:
+        for row in rows:
+            values[current.id, row['field_id']] = dict(row, asset_id=current.id, asset_type_id=current.asset_type_id)
+        document = documents.get(current.id, current.document)
+        if document is None:
+            rebuild.add(current.id)
+            documents[current.id] = None
+            continue
+        documents[current.id] = {**document, **document_for(schema, rows)}
+    return list(values.values()), documents, rebuild
+
+def stored_values_query(asset_ids):
+    """Select (asset id, field id, text value, number value) of every stored value of some assets"""
+    return (
+        select(AssetValue.asset_id, AssetValue.field_id, AssetValue.text_value, AssetValue.number_value)
+        .where(AssetValue.asset_id.in_(asset_ids))
+        .order_by(AssetValue.asset_id)
+    )
+
+def rebuild_planned_documents(documents, rebuild, schemas, stored):
+    """Fill in the documents plan_updates left to rebuild from stored_values_query rows"""
+    for asset_id, group in groupby(stored, key=operator.itemgetter(0)):
+        data = schemas[asset_id].data(row[1:] for row in group)
+        documents[asset_id] = {name: value for name, value in data.items() if value is not None}
+    for asset_id in rebuild:
+        if documents[asset_id] is None:
+            documents[asset_id] = {}
+
+def document_updates(documents):
+    """Parameters of the UPDATE batch that stores new documents"""
+    # Value changes alone would not bump the assets' updated_at
+    now = datetime.utcnow()
+    return [{'id': asset_id, 'document': document, 'updated_at': now} for asset_id, document in documents.items()]
+
+def asset_change_row(op, asset_id, schema, rows):
+    """Change log row of an asset created or updated with some asset_values rows"""
+    return {'entity': 'asset', 'entity_id': asset_id, 'asset_type_id': schema.type_id, 'op': op,
+            'data': document_for(schema, rows)}
+
+def asset_type_change_row(op, asset_type, fields):
+    """Change log row of an asset type created or given new fields"""
+    return {'entity': 'asset_type', 'entity_id': asset_type.id, 'asset_type_id': asset_type.id, 'op': op,
+            'data': {'name': asset_type.name, 'fields': {f.name: FieldType(f.field_type).value for f in fields}}}
+
+def change_log_lock(dialect):
+    """Statement to run before appending to the change log, or None
+
+    On PostgreSQL concurrent transactions could otherwise commit their sequence
+    numbers out of order, and a consumer that read past a number would miss a
+    smaller one committed later. The lock is held until commit, so write it last.
+    """
+    if dialect == 'postgresql':
+        return select(func.pg_advisory_xact_lock(CHANGE_LOG_LOCK))
+    return None
+
+def record_changes(changes):
+    """Append rows to the change log in the current transaction, after its other writes, and queue their events"""
+    if not changes:
+        return
+    lock = change_log_lock(db.session.get_bind().dialect.name)
+    if lock is not None:
+        db.session.execute(lock)
+    seqs = db.session.scalars(
+        insert(AssetChange.__table__).returning(AssetChange.seq, sort_by_parameter_order=True), changes
+    ).all()
+    notify = broker.prepare(db.session, [dict(change, seq=seq) for change, seq in zip(changes, seqs)])
+    if notify is not None:
+        db.session.execute(notify)
+
+def record_error(index, e):
+    """Error entry of a rejected bulk record, with the field errors of a ValidationError"""
+    error = {'index': index, 'message': str(e)}
+    if isinstance(e, ValidationError):
+        error['errors'] = e.errors
+    return error
+
+def validate_new_assets(records, schemas):
+    """Split bulk create records into ([(index, schema, value rows)], [{index, message}]), given {type id: schema}"""
+    valid, errors = [], []
+    for index, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("Record must be an object")
+            type_id = record.get('asset_type_id')
+            # Same filter as record_type_ids; bool is an int subclass and True would pick type 1
+            if type(type_id) is not int:
+                raise ValueError("asset_type_id must be an integer")
+            schema = schemas.get(type_id)
+            if schema is None:
+                raise ValueError(f"Asset type {type_id} does not exist")
+            # Required like on a single create, value_rows rejects the None of a missing key
+            rows = schema.value_rows(record.get('data'))
+        except ValueError as e:
+            errors.append(record_error(index, e))
+            continue
+        valid.append((index, schema, rows))
+    return valid, errors
+
+def validate_asset_updates(records, current, schemas):
+    """Split bulk update records into ([(index, locked row, schema, value rows)], [{index, message}])"""
+    valid, errors = [], []
+    for index, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("Record must be an object")
+            asset_id = record.get('id')
+            # Same filter as record_asset_ids; bool is an int subclass and True would pick asset 1
+            if type(asset_id) is not int:
+                raise ValueError("id must be an integer")
+            row = current.get(asset_id)
+            if row is None:
+                raise ValueError(f"Asset {asset_id} does not exist")
+            schema = schemas[row.asset_type_id]
+            rows = schema.value_rows(record.get('data'))
+        except ValueError as e:
+            errors.append(record_error(index, e))
+            continue
+        valid.append((index, row, schema, rows))
+    return valid, errors
+
+def record_type_ids(records):
+    """Asset type ids referenced by well-formed bulk create records"""
+    return {
+        record.get('asset_type_id') for record in records
+        if isinstance(record, dict) and type(record.get('asset_type_id')) is int
+    }
+
+def record_asset_ids(records):
+    """Asset ids referenced by well-formed bulk update records"""
+    return {record.get('id') for record in records if isinstance(record, dict) and type(record.get('id')) is int}
+
+def lock_assets_query(asset_ids):
+    """Select (id, asset_type_id, document) of assets about to be updated, locking their rows"""
+    return (
+        select(Asset.id, Asset.asset_type_id, Asset.document)
+        .where(Asset.id.in_(asset_ids))
+        # Locked in id order, so two bulk updates sharing assets cannot wait on each other
+        .order_by(Asset.id)
+        .with_for_update()
+    )
+
+def number_aggregates():
+    value = AssetValue.number_value
+    return func.count(value), func.sum(value), func.min(value), func.max(value), func.avg(value)
+
+def number_summary(name, aggregates):
+    """Stats of a NUMBER field from the columns of number_aggregates()"""
+    count, total, minimum, maximum, average = aggregates
+    return {'field': name, 'count': count, 'sum': total, 'min': minimum, 'max': maximum,
+            'avg': float(average) if average is not None else None}
+
+def floor_value(expr, dialect):
+    """floor() of a non-negative expression as an integer"""
+    if dialect == 'sqlite':
+        # SQLite only has floor() when built with its math functions, CAST truncates the same way here
+        return cast(expr, Integer)
+    return cast(func.floor(expr), Integer)
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# FTS5 trigram index of asset_values.text_value, created with the table on SQLite (see models.py)
+asset_values_fts = table('asset_values_fts', column('rowid'), column('asset_values_fts'))
+
+def search_predicates(q, mode, dialect):
+    """WHERE clauses matching the text values that contain (or start with) q, case insensitively"""
+    pattern = escape_like(q) + '%' if mode == 'prefix' else '%' + escape_like(q) + '%'
+    if dialect == 'postgresql':
+        # Served by the ix_asset_values_text_value_trgm GIN index
+        return [AssetValue.text_value.ilike(pattern, escape='\\')]
+    predicates = [AssetValue.text_value.like(pattern, escape='\\')]
+    if dialect == 'sqlite' and len(q) >= MIN_INDEXED_SEARCH:
+        # The trigram phrase narrows the candidates through the index, LIKE then checks prefixes
+        phrase = '"' + q.replace('"', '""') + '"'
+        predicates.append(AssetValue.id.in_(
+            select(asset_values_fts.c.rowid).where(asset_values_fts.c.asset_values_fts.op('MATCH')(phrase))
+        ))
+    return predicates
 
 class AssetTypeService:
     @staticmethod
     def get_all_asset_types():
         """Get all asset types"""
         return AssetType.query.all()
+
+    @staticmethod
+    def get_asset_types_version():
+        """Get (count, last updated_at) of all asset types, which changes whenever the list does"""
+        return db.session.execute(select(func.count(AssetType.id), func.max(AssetType.updated_at))).one()
+
+    @staticmethod
+    def get_asset_type_version(type_id):
+        """Get the updated_at of an asset type, which changes whenever the type or its fields do"""
+        updated_at = db.session.execute(select(AssetType.updated_at).where(AssetType.id == type_id)).first()
+        if updated_at is None:
+            abort(404)
+        return updated_at[0]
+
+    @staticmethod
+    def get_asset_types_page(limit=DEFAULT_PAGE_SIZE, after=None):
+        """Get one page of asset types with an id greater than after"""
+        query = AssetType.query.options(selectinload(AssetType.fields))
+        return paginate(query, AssetType.id, limit, after)
     
     @staticmethod
     def get_asset_type(type_id):
@@ -18,18 +388,27 @@ class AssetTypeService:
         new_asset_type = AssetType(name=name)
         db.session.add(new_asset_type)
         
+        # Reuse existing fields, looked up in one query
+        names = [field_data['name'] for field_data in fields_data]
+        existing = {f.name: f for f in AssetField.query.filter(AssetField.name.in_(names))}
+
         # Create and associate fields
         for field_data in fields_data:
-            field = AssetField.query.filter_by(name=field_data['name']).first()
+            field = existing.get(field_data['name'])
             if not field:
                 field = AssetField(
                     name=field_data['name'],
                     field_type=FieldType(field_data['field_type'])
                 )
                 db.session.add(field)
+                existing[field.name] = field
             new_asset_type.fields.append(field)
-        
+
+        db.session.flush()
+        record_changes([asset_type_change_row('create', new_asset_type, new_asset_type.fields)])
         db.session.commit()
+        schema_cache.invalidate(new_asset_type.id)
+        response_cache.invalidate('asset_types')
         return new_asset_type
     
     @staticmethod
@@ -50,7 +429,13 @@ class AssetTypeService:
             db.session.add(field)
         
         asset_type.fields.append(field)
+        # The association change alone would not bump the type's updated_at
+        asset_type.updated_at = datetime.utcnow()
+        db.session.flush()
+        record_changes([asset_type_change_row('add_field', asset_type, [field])])
         db.session.commit()
+        schema_cache.invalidate(type_id)
+        response_cache.invalidate('asset_types', f'asset_type:{type_id}')
         return field
     
     @staticmethod
@@ -59,62 +444,407 @@ class AssetTypeService:
         asset_type = AssetType.query.get_or_404(type_id)
         return asset_type.fields
 
+    @staticmethod
+    def get_stats(type_id, buckets=DEFAULT_HISTOGRAM_BUCKETS, group_by=None, limit=DEFAULT_STATS_GROUPS):
+        """Aggregate the NUMBER fields of a type's assets in the database
+
+        Returns count/sum/min/max/avg and an equal width histogram per field and,
+        when group_by names a TEXT field, the same aggregates (without histograms)
+        for the limit most common values of that field.
+        """
+        schema = schema_cache.get(type_id)
+        if schema is None:
+            abort(404)
+        numbers = {f.id: f.name for f in schema.fields.values() if f.field_type == FieldType.NUMBER}
+        group_field = None
+        if group_by is not None:
+            group_field = schema.fields.get(group_by)
+            if group_field is None or group_field.field_type != FieldType.TEXT:
+                raise ValueError(f"Field {group_by} is not a text field of this asset type")
+
+        asset_count = db.session.scalar(select(func.count(Asset.id)).where(Asset.asset_type_id == type_id))
+        stats = {'asset_type_id': type_id, 'asset_count': asset_count, 'fields': [], 'groups': None}
+        if numbers:
+            rows = db.session.execute(
+                select(AssetValue.field_id, *number_aggregates())
+                .where(AssetValue.asset_type_id == type_id, AssetValue.field_id.in_(numbers),
+                       AssetValue.number_value.is_not(None))
+                .group_by(AssetValue.field_id)
+            ).all()
+            summaries = {row[0]: number_summary(numbers[row[0]], row[1:]) for row in rows}
+            histograms = AssetTypeService._histograms(type_id, summaries, buckets)
+            stats['fields'] = [
+                dict(summaries.get(field_id) or number_summary(name, (0, None, None, None, None)),
+                     histogram=histograms.get(field_id, []))
+                for field_id, name in numbers.items()
+            ]
+        if group_field is not None:
+            stats['groups'] = AssetTypeService._groups(type_id, group_field, numbers, limit)
+        return stats
+
+    @staticmethod
+    def _histograms(type_id, summaries, buckets):
+        """Count each field's values in buckets equal width buckets between its min and max, in one query"""
+        widths = {
+            field_id: (summary['max'] - summary['min']) / buckets
+            for field_id, summary in summaries.items() if summary['count']
+        }
+        if not widths:
+            return {}
+        value = AssetValue.number_value
+        offsets = [
+            (AssetValue.field_id == field_id, (value - summaries[field_id]['min']) / width if width else 0)
+            for field_id, width in widths.items()
+        ]
+        bucket = floor_value(case(*offsets), db.session.get_bind().dialect.name)
+        # The maximum itself would fall just past the last bucket
+        bucket = case((bucket >= buckets, buckets - 1), else_=bucket).label('bucket')
+        # Grouped outside a subquery so the bucket expression's parameters are not repeated in GROUP BY
+        values = (
+            select(AssetValue.field_id, bucket)
+            .where(AssetValue.asset_type_id == type_id, AssetValue.field_id.in_(widths),
+                   AssetValue.number_value.is_not(None))
+        ).subquery()
+        rows = db.session.execute(
+            select(values.c.field_id, values.c.bucket, func.count())
+            .group_by(values.c.field_id, values.c.bucket)
+        )
+        counts = {(field_id, int(index)): count for field_id, index, count in rows}
+        return {
+            field_id: [
+                {
+                    'lower': summaries[field_id]['min'] + i * width,
+                    'upper': summaries[field_id]['min'] + (i + 1) * width,
+                    'count': counts.get((field_id, i), 0),
+                }
+                for i in range(buckets if width else 1)
+            ]
+            for field_id, width in widths.items()
+        }
+
+    @staticmethod
+    def _groups(type_id, group_field, numbers, limit):
+        """Asset counts and NUMBER field aggregates of the most common values of a TEXT field"""
+        group_value = aliased(AssetValue)
+        top = (
+            select(group_value.text_value.label('value'), func.count().label('count'))
+            .where(group_value.asset_type_id == type_id, group_value.field_id == group_field.id)
+            .group_by(group_value.text_value)
+            .order_by(func.count().desc(), group_value.text_value)
+            .limit(limit)
+        ).subquery()
+        groups = db.session.execute(select(top.c.value, top.c['count'])).all()
+        summaries = {}
+        if numbers and groups:
+            rows = db.session.execute(
+                select(group_value.text_value, AssetValue.field_id, *number_aggregates())
+                .join(top, top.c.value == group_value.text_value)
+                .join(AssetValue, and_(AssetValue.asset_type_id == type_id,
+                                       AssetValue.asset_id == group_value.asset_id,
+                                       AssetValue.field_id.in_(numbers),
+                                       AssetValue.number_value.is_not(None)))
+                .where(group_value.asset_type_id == type_id, group_value.field_id == group_field.id)
+                .group_by(group_value.text_value, AssetValue.field_id)
+            )
+            for value, field_id, *aggregates in rows:
+                summaries[value, field_id] = number_summary(numbers[field_id], aggregates)
+        return [
+            {
+                'value': value,
+                'count': count,
+                'fields': [summaries[value, field_id] for field_id in numbers if (value, field_id) in summaries],
+            }
+            for value, count in sorted(groups, key=lambda group: (-group[1], group[0]))
+        ]
+
 
 class AssetService:
     @staticmethod
-    def get_all_assets(asset_type_id=None):
-        """Get all assets, optionally filtered by asset type"""
-        query = Asset.query
+    def _assets_query(asset_type_id=None, filters=None):
+        query = Asset.query.options(*read_options())
         if asset_type_id:
             query = query.filter_by(asset_type_id=asset_type_id)
-        return query.all()
-    
+        return filter_by_values(query, filters, asset_type_id)
+
+    @staticmethod
+    def get_assets_version(asset_type_id=None, filters=None, limit=None, after=None):
+        """Get (count, last asset updated_at, last type updated_at) of the assets a list would return
+
+        With limit, versions one keyset page by the ids and last updated_at of its
+        own rows instead, so checking a page costs no more than reading it.
+        """
+        if limit is None:
+            count, assets_updated_at = AssetService._assets_query(asset_type_id, filters).with_entities(
+                func.count(Asset.id), func.max(Asset.updated_at)
+            ).one()
+        else:
+            page = filter_by_values(asset_page_query(asset_type_id, limit, after), filters, asset_type_id)
+            rows = db.session.execute(page.with_only_columns(Asset.id, Asset.updated_at)).all()
+            # The row past the page is included, next_cursor depends on it
+            count = tuple(row.id for row in rows)
+            assets_updated_at = max((row.updated_at for row in rows if row.updated_at), default=None)
+        # Asset data includes every field of its type, so schema changes count too
+        types = select(func.max(AssetType.updated_at))
+        if asset_type_id:
+            types = types.where(AssetType.id == asset_type_id)
+        return count, assets_updated_at, db.session.scalar(types)
+
+    @staticmethod
+    def get_asset_version(asset_id, for_update=False):
+        """Get (asset updated_at, type updated_at) of an asset, optionally locking the asset row"""
+        query = (
+            select(Asset.updated_at, AssetType.updated_at)
+            .join(AssetType, AssetType.id == Asset.asset_type_id)
+            .where(Asset.id == asset_id)
+        )
+        if for_update:
+            query = query.with_for_update(of=Asset)
+        version = db.session.execute(query).first()
+        if version is None:
+            abort(404)
+        return tuple(version)
+
+    @staticmethod
+    def get_asset_rows(asset_type_id=None, filters=None, limit=None, after=None):
+        """Get assets as response payloads pivoted from plain rows, without building ORM objects
+
+        Returns (assets, next_cursor); next_cursor is only set when limit cuts the list short.
+        """
+        page = filter_by_values(asset_page_query(asset_type_id, limit, after), filters, asset_type_id)
+        rows = db.session.execute(
+            asset_rows_query(page, current_app.config['ASSET_DOCUMENT_READS'], asset_type_id)
+        )
+        return pivot_asset_rows(rows, schema_cache.get, limit)
+
+    @staticmethod
+    def iter_asset_rows(asset_type_id=None, batch_size=EXPORT_BATCH_SIZE):
+        """Yield every asset payload in id order, read through get_asset_rows one keyset batch at a time"""
+        for assets in AssetService.iter_asset_row_batches(asset_type_id, batch_size):
+            yield from assets
+
+    @staticmethod
+    def iter_asset_row_batches(asset_type_id=None, batch_size=EXPORT_BATCH_SIZE):
+        """Yield every asset payload in id order as lists of at most batch_size, one get_asset_rows query each"""
+        after = None
+        while True:
+            assets, after = AssetService.get_asset_rows(asset_type_id, limit=batch_size, after=after)
+            if assets:
+                yield assets
+            if after is None:
+                return
+
+    @staticmethod
+    def search_assets(q, asset_type_id, field_names=None, mode='substring', limit=DEFAULT_PAGE_SIZE, offset=0):
+        """Rank the assets of a type by how much of one of their TEXT values q covers
+
+        Only values containing q (starting with it in prefix mode) match. Returns
+        ([{'id', 'score'}], next_offset); next_offset is None on the last page.
+        """
+        schema = schema_cache.get(asset_type_id)
+        if schema is None:
+            abort(404)
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unsupported search mode {mode}")
+        if not q:
+            raise ValueError("Search query must not be empty")
+        text_fields = {name: f for name, f in schema.fields.items() if f.field_type == FieldType.TEXT}
+        for name in field_names or ():
+            if name not in text_fields:
+                raise ValueError(f"Field {name} is not a text field of this asset type")
+        field_ids = [text_fields[name].id for name in field_names or text_fields]
+        if not field_ids:
+            return [], None
+
+        # An exact match scores 1, a short query inside a long value close to 0
+        score = func.max(literal(float(len(q)), Float) / func.length(AssetValue.text_value)).label('score')
+        rows = db.session.execute(
+            select(AssetValue.asset_id, score)
+            .where(AssetValue.asset_type_id == asset_type_id, AssetValue.field_id.in_(field_ids),
+                   *search_predicates(q, mode, db.session.get_bind().dialect.name))
+            .group_by(AssetValue.asset_id)
+            .order_by(score.desc(), AssetValue.asset_id)
+            .limit(limit + 1)
+            .offset(offset)
+        ).all()
+        next_offset = offset + limit if len(rows) > limit else None
+        return [{'id': asset_id, 'score': score} for asset_id, score in rows[:limit]], next_offset
+
     @staticmethod
     def get_asset(asset_id):
         """Get a specific asset by ID"""
-        return Asset.query.get_or_404(asset_id)
+        return Asset.query.options(*read_options()).get_or_404(asset_id)
     
     @staticmethod
     def create_asset(asset_type_id, field_values):
         """Create a new asset with field values"""
-        # Create new asset
-        new_asset = Asset(asset_type_id=asset_type_id)
+        schema = schema_cache.get(asset_type_id)
+        if schema is None:
+            raise ValueError(f"Asset type {asset_type_id} does not exist")
+        # Validate every value before touching the database
+        rows = schema.value_rows(field_values)
+
+        new_asset = Asset(asset_type_id=asset_type_id, document=document_for(schema, rows))
+        new_asset.values = [AssetValue(**row) for row in rows]
         db.session.add(new_asset)
+        db.session.flush()
+        record_changes([asset_change_row('create', new_asset.id, schema, rows)])
         db.session.commit()
-        
-        try:
-            # Set field values
-            for field_name, value in field_values.items():
-                try:
-                    new_asset.set_value(field_name, value)
-                except ValueError as e:
-                    db.session.delete(new_asset)
-                    db.session.commit()
-                    raise ValueError(str(e))
-            
-            db.session.commit()
-            return new_asset
-        except Exception as e:
-            db.session.delete(new_asset)
-            db.session.commit()
-            raise
+        response_cache.invalidate('assets')
+        return new_asset
     
+    @staticmethod
+    def _lock_assets(asset_ids):
+        """Read (id, asset_type_id, document) of assets about to be updated, locking their rows"""
+        return {row.id: row for row in db.session.execute(lock_assets_query(asset_ids))}
+
+    @staticmethod
+    def _write_updates(updates):
+        """Upsert the values of [(locked asset row, schema, value rows)] and refresh their documents
+
+        Runs one upsert batch for every value and one UPDATE batch for the assets,
+        then logs the changes. The caller commits.
+        """
+        values, documents, rebuild = plan_updates(updates)
+        if values:
+            db.session.execute(upsert_statement(db.session.get_bind().dialect.name), values)
+        if rebuild:
+            schemas = {current.id: schema for current, schema, _ in updates}
+            stored = db.session.execute(stored_values_query(rebuild))
+            rebuild_planned_documents(documents, rebuild, schemas, stored)
+        db.session.execute(update(Asset), document_updates(documents))
+        record_changes([asset_change_row('update', current.id, schema, rows) for current, schema, rows in updates])
+
     @staticmethod
     def update_asset(asset_id, field_values):
         """Update an asset's field values"""
-        asset = Asset.query.get_or_404(asset_id)
-        
-        try:
-            # Update field values
-            for field_name, value in field_values.items():
-                try:
-                    asset.set_value(field_name, value)
-                except ValueError as e:
-                    db.session.rollback()
-                    raise ValueError(str(e))
-            
-            db.session.commit()
-            return asset
-        except Exception as e:
+        current = AssetService._lock_assets([asset_id]).get(asset_id)
+        if current is None:
+            abort(404)
+        schema = schema_cache.get(current.asset_type_id)
+        rows = schema.value_rows(field_values)
+
+        AssetService._write_updates([(current, schema, rows)])
+        db.session.commit()
+        response_cache.invalidate('assets', f'asset:{asset_id}')
+        return AssetService.get_asset(asset_id)
+
+    @staticmethod
+    def bulk_update_assets(records):
+        """Update many assets' values in a single transaction, returning the updated ids and per-record errors"""
+        current = AssetService._lock_assets(record_asset_ids(records))
+        schemas = {type_id: schema_cache.get(type_id) for type_id in {row.asset_type_id for row in current.values()}}
+
+        # Validate everything up front so one bad record does not abort the batch
+        valid, errors = validate_asset_updates(records, current, schemas)
+        if not valid:
             db.session.rollback()
-            raise
+            return [], errors
+
+        AssetService._write_updates([(row, schema, rows) for _, row, schema, rows in valid])
+        db.session.commit()
+        response_cache.invalidate('assets', *{f'asset:{row.id}' for _, row, _, _ in valid})
+
+        updated = [{'index': index, 'id': row.id} for index, row, _, _ in valid]
+        return updated, errors
+
+    @staticmethod
+    def bulk_create_assets(records):
+        """Create many assets in a single transaction, returning the created ids and per-record errors"""
+        schemas = {type_id: schema_cache.get(type_id) for type_id in record_type_ids(records)}
+
+        # Validate everything up front so one bad record does not abort the batch
+        valid, errors = validate_new_assets(records, schemas)
+        if not valid:
+            return [], errors
+
+        created = AssetService._insert_assets(valid)
+        db.session.commit()
+        response_cache.invalidate('assets')
+        return created, errors
+
+    @staticmethod
+    def _insert_assets(valid):
+        """Insert the validated [(index, schema, value rows)] of validate_new_assets, returning [{index, id}]
+
+        Runs one INSERT batch each for the assets, their values and their changes. The caller commits.
+        """
+        asset_ids = db.session.scalars(
+            insert(Asset).returning(Asset.id, sort_by_parameter_order=True),
+            [{'asset_type_id': schema.type_id, 'document': document_for(schema, rows)} for _, schema, rows in valid]
+        ).all()
+        values = [
+            dict(row, asset_id=asset_id, asset_type_id=schema.type_id)
+            for (_, schema, rows), asset_id in zip(valid, asset_ids)
+            for row in rows
+        ]
+        if values:
+            # Against the table rather than the entity, so the rows go out as one executemany
+            db.session.execute(insert(AssetValue.__table__), values)
+        record_changes([
+            asset_change_row('create', asset_id, schema, rows)
+            for (_, schema, rows), asset_id in zip(valid, asset_ids)
+        ])
+        return [{'index': index, 'id': asset_id} for (index, _, _), asset_id in zip(valid, asset_ids)]
+
+    @staticmethod
+    def backfill_field_default(asset_type_id, field_name, value, after=None, batch_size=EXPORT_BATCH_SIZE):
+        """Give the assets of one keyset batch of a type that have no value for a field the default value
+
+        Returns (assets scanned, cursor of the next batch or None after the last one). The caller commits.
+        """
+        schema = schema_cache.get(asset_type_id)
+        if schema is None:
+            raise ValueError(f"Asset type {asset_type_id} does not exist")
+        rows = schema.value_rows({field_name: value})
+        page = select(Asset.id).where(Asset.asset_type_id == asset_type_id)
+        if after is not None:
+            page = page.where(Asset.id > after)
+        asset_ids = db.session.scalars(page.order_by(Asset.id).limit(batch_size)).all()
+        if not asset_ids:
+            return 0, None
+
+        # Locked before looking for missing values, so a concurrent update is never overwritten
+        current = AssetService._lock_assets(asset_ids)
+        has_value = set(db.session.scalars(
+            select(AssetValue.asset_id)
+            .where(AssetValue.asset_type_id == asset_type_id, AssetValue.asset_id.in_(asset_ids),
+                   AssetValue.field_id == rows[0]['field_id'])
+        ))
+        missing = [(row, schema, rows) for asset_id, row in current.items() if asset_id not in has_value]
+        if missing:
+            AssetService._write_updates(missing)
+        return len(asset_ids), asset_ids[-1] if len(asset_ids) == batch_size else None
+
+    @staticmethod
+    def rebuild_documents(asset_type_id=None, batch_size=EXPORT_BATCH_SIZE):
+        """Rewrite the document column of every asset from asset_values, one transaction per batch"""
+        rebuilt, after = 0, None
+        while True:
+            query = Asset.query.options(*Asset.eager_load_options())
+            if asset_type_id:
+                query = query.filter_by(asset_type_id=asset_type_id)
+            batch, after = paginate(query, Asset.id, batch_size, after)
+            for asset in batch:
+                asset.document = asset.build_document(schema_cache.get(asset.asset_type_id))
+            db.session.commit()
+            rebuilt += len(batch)
+            if after is None:
+                return rebuilt
+
+
+class ChangeService:
+    @staticmethod
+    def get_changes(since=0, limit=DEFAULT_CHANGES_PAGE_SIZE, asset_type_id=None):
+        """Get the changes logged after the since sequence number in order, and the since of the next batch"""
+        query = select(AssetChange).where(AssetChange.seq > since)
+        if asset_type_id:
+            query = query.where(AssetChange.asset_type_id == asset_type_id)
+        changes = db.session.scalars(query.order_by(AssetChange.seq).limit(limit)).all()
+        return changes, changes[-1].seq if changes else since
+
+    @staticmethod
+    def prune_changes(before):
+        """Delete the changes logged before a datetime, returning how many were deleted"""
+        deleted = db.session.execute(delete(AssetChange).where(AssetChange.created_at < before)).rowcount
+        db.session.commit()
+        return deleted
@@ -1,6 +1,8 @@
 import pytest
 from app import app as flask_app, db
-from models import AssetType, AssetField, FieldType
+from models import Asset, AssetType, AssetField, FieldType
+from response_cache import response_cache
+from schema_cache import schema_cache
 
 @pytest.fixture
 def app():
@@ -12,6 +14,9 @@ def app():
         yield flask_app
         db.session.remove()
         db.drop_all()
+    # Every test starts from an empty database, so ids are reused
+    schema_cache.clear()
+    response_cache.clear()
 
 @pytest.fixture
 def client(app):
@@ -36,3 +41,15 @@ def sample_asset_type(app):
         # Get a fresh instance that's attached to the session
         asset_type_id = asset_type.id
         return db.session.get(AssetType, asset_type_id)
+
+@pytest.fixture
+def sample_asset(app, sample_asset_type):
+    """Create a sample asset for testing"""
+    asset = Asset(asset_type_id=sample_asset_type.id)
+    db.session.add(asset)
+    db.session.commit()
+    
+    asset.set_value('Serial Number', 'ABC123')
+    asset.set_value('Model', 'ThinkPad')
+    db.session.commit()
+    return asset
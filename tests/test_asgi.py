@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from app import db
+from response_cache import response_cache
+from schema_cache import schema_cache
+
+pytest.importorskip('starlette')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('httpx')
+
+from starlette.testclient import TestClient
+from asgi import create_app
+
+@pytest.fixture
+def async_client(tmp_path):
+    path = tmp_path / 'assets.db'
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    engine.dispose()
+    with TestClient(create_app(f'sqlite+aiosqlite:///{path}')) as test_client:
+        test_client.headers['X-API-KEY'] = 'Dyn4m1cAsS3tKey'
+        yield test_client
+    schema_cache.clear()
+    response_cache.clear()
+
+@pytest.fixture
+def laptop_type(async_client):
+    response = async_client.post('/api/asset-types/', json={
+        'name': 'Laptop',
+        'fields': [{'name': 'Serial Number', 'field_type': 'text'}, {'name': 'Price', 'field_type': 'number'}]
+    })
+    assert response.status_code == 201
+    return response.json()
+
+def test_requires_api_key(async_client):
+    """Test that requests without the API key are rejected"""
+    async_client.headers.pop('X-API-KEY')
+    assert async_client.get('/api/assets/').status_code == 401
+
+def test_asset_types(async_client, laptop_type):
+    """Test creating and reading asset types and their fields"""
+    assert [f['name'] for f in laptop_type['fields']] == ['Serial Number', 'Price']
+    assert async_client.get(f'/api/asset-types/{laptop_type["id"]}/').json() == laptop_type
+
+    response = async_client.post(f'/api/asset-types/{laptop_type["id"]}/fields/',
+                                 json={'name': 'Model', 'field_type': 'text'})
+    assert response.status_code == 201
+    fields = async_client.get(f'/api/asset-types/{laptop_type["id"]}/fields/').json()
+    assert [f['name'] for f in fields] == ['Serial Number', 'Price', 'Model']
+
+    page = async_client.get('/api/asset-types/?limit=10').json()
+    assert page['next_cursor'] is None and len(page['items']) == 1
+    assert async_client.get('/api/asset-types/999/').status_code == 404
+
+def test_assets_crud(async_client, laptop_type):
+    """Test creating, reading, filtering and updating assets"""
+    response = async_client.post('/api/assets/', json={
+        'asset_type_id': laptop_type['id'],
+        'data': {'Serial Number': 'ABC123', 'Price': '999.5'}
+    })
+    assert response.status_code == 201
+    created = response.json()
+    assert created['data'] == {'Serial Number': 'ABC123', 'Price': 999.5}
+
+    response = async_client.put(f'/api/assets/{created["id"]}/', json={'data': {'Price': 899}})
+    assert response.json()['data'] == {'Serial Number': 'ABC123', 'Price': 899.0}
+    assert async_client.get(f'/api/assets/{created["id"]}/').json() == response.json()
+
+    assert len(async_client.get('/api/assets/?filter[Price][lt]=900').json()) == 1
+    assert async_client.get('/api/assets/?filter[Price][gt]=900').json() == []
+    assert async_client.get('/api/assets/999/').status_code == 404
+    assert async_client.put('/api/assets/999/', json={'data': {}}).status_code == 404
+
+    response = async_client.post('/api/assets/', json={'asset_type_id': laptop_type['id'], 'data': {'Price': 'x'}})
+    assert response.status_code == 400
+    assert response.json()['message'] == 'Invalid number value for field Price'
+    assert response.json()['errors'] == [{'field': 'Price', 'message': 'Invalid number value for field Price'}]
+
+def test_bulk_assets(async_client, laptop_type):
+    """Test bulk creating and updating assets with per-record errors"""
+    response = async_client.post('/api/assets/bulk/', json={'assets': [
+        {'asset_type_id': laptop_type['id'], 'data': {'Serial Number': 'A1'}},
+        {'asset_type_id': 999, 'data': {}},
+        {'asset_type_id': laptop_type['id'], 'data': {'Serial Number': 'A2'}},
+    ]})
+    assert response.status_code == 201
+    created = response.json()['created']
+    assert [c['index'] for c in created] == [0, 2]
+
+    response = async_client.patch('/api/assets/', json={'assets': [
+        {'id': created[0]['id'], 'data': {'Price': 10}},
+        {'id': 999, 'data': {}},
+        {'id': [created[0]['id']], 'data': {}},
+    ]})
+    assert response.status_code == 200
+    assert [e['index'] for e in response.json()['errors']] == [1, 2]
+
+    page = async_client.get(f'/api/assets/?asset_type_id={laptop_type["id"]}&limit=1').json()
+    assert page['items'][0]['data'] == {'Serial Number': 'A1', 'Price': 10.0}
+    assert page['next_cursor'] == created[0]['id']
+
+def test_cache_invalidated_off_the_event_loop(async_client, laptop_type, monkeypatch):
+    """Test that writes invalidate the response cache in a thread, as the redis backend blocks"""
+    on_loop, off_loop = [], []
+    def invalidate(*tags):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(tags)
+        except RuntimeError:
+            off_loop.append(tags)
+    monkeypatch.setattr(response_cache, 'invalidate', invalidate)
+
+    response = async_client.post('/api/assets/', json={'asset_type_id': laptop_type['id'], 'data': {}})
+    assert response.status_code == 201
+    assert on_loop == [] and off_loop == [('assets',)]
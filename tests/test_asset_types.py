@@ -1,6 +1,7 @@
 import pytest
 import json
 from models import AssetType, AssetField
+from schema_cache import schema_cache
 
 def test_create_asset_type(client):
     """Test creating a new asset type with fields"""
@@ -97,3 +98,72 @@ def test_create_duplicate_field(client, sample_asset_type):
     
     json_data = response.get_json()
     assert 'message' in json_data
+
+def test_get_asset_types_paginated(client, sample_asset_type):
+    """Test getting asset types one keyset page at a time"""
+    response = client.get('/api/asset-types/?limit=1')
+    assert response.status_code == 200
+
+    page = response.get_json()
+    assert len(page['items']) == 1
+    assert page['items'][0]['name'] == 'Laptop'
+    assert page['next_cursor'] is None
+
+def test_schema_cache_invalidated_when_field_added(client, sample_asset_type):
+    """Test that a field added to a type is usable right after the type's schema was cached"""
+    asset_data = {'asset_type_id': sample_asset_type.id, 'data': {'Serial Number': 'A1'}}
+    assert client.post('/api/assets/', json=asset_data).status_code == 201
+    assert client.post('/api/assets/', json=asset_data).status_code == 201
+    stats = schema_cache.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] >= 1
+
+    response = client.post(f'/api/asset-types/{sample_asset_type.id}/fields/',
+                           json={'name': 'RAM', 'field_type': 'number'})
+    assert response.status_code == 201
+
+    asset_data['data']['RAM'] = 16
+    response = client.post('/api/assets/', json=asset_data)
+    assert response.status_code == 201
+    assert response.get_json()['data']['RAM'] == 16
+
+def test_get_asset_type_not_modified(client, sample_asset_type):
+    """Test that adding a field changes the asset type ETag"""
+    etag = client.get(f'/api/asset-types/{sample_asset_type.id}/').headers['ETag']
+    response = client.get(f'/api/asset-types/{sample_asset_type.id}/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    client.post(f'/api/asset-types/{sample_asset_type.id}/fields/', json={'name': 'RAM', 'field_type': 'number'})
+    response = client.get(f'/api/asset-types/{sample_asset_type.id}/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+def test_asset_type_stats(client):
+    """Test numeric field aggregates, histograms and text field groups"""
+    type_id = client.post('/api/asset-types/', json={
+        'name': 'Laptop',
+        'fields': [{'name': 'Model', 'field_type': 'text'}, {'name': 'Price', 'field_type': 'number'}]
+    }).get_json()['id']
+    for model, price in [('XPS', 100), ('XPS', 200), ('Yoga', 300), ('Yoga', 400), ('Envy', 1000)]:
+        client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Model': model, 'Price': price}})
+    client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Model': 'XPS'}})
+
+    response = client.get(f'/api/asset-types/{type_id}/stats/?buckets=3&group_by=Model&limit=2')
+    assert response.status_code == 200
+    stats = response.get_json()
+    assert stats['asset_count'] == 6
+    price = stats['fields'][0]
+    assert (price['field'], price['count'], price['sum'], price['min'], price['max'], price['avg']) == \
+        ('Price', 5, 2000, 100, 1000, 400)
+    assert [b['count'] for b in price['histogram']] == [3, 1, 1]
+    assert price['histogram'][0] == {'lower': 100, 'upper': 400, 'count': 3}
+
+    assert [(g['value'], g['count']) for g in stats['groups']] == [('XPS', 3), ('Yoga', 2)]
+    assert stats['groups'][0]['fields'][0]['sum'] == 300
+
+def test_asset_type_stats_invalid(client, sample_asset_type):
+    """Test stats of missing types and grouping by fields that are not text fields of the type"""
+    assert client.get('/api/asset-types/999/stats/').status_code == 404
+    response = client.get(f'/api/asset-types/{sample_asset_type.id}/stats/?group_by=Price')
+    assert response.status_code == 400
+    stats = client.get(f'/api/asset-types/{sample_asset_type.id}/stats/').get_json()
+    assert stats == {'asset_type_id': sample_asset_type.id, 'asset_count': 0, 'fields': [], 'groups': None}
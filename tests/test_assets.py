@@ -1,18 +1,11 @@
+import csv
+import io
+import json
 import pytest
+from sqlalchemy import event, text
 from app import db
-from models import Asset, AssetType, AssetField, FieldType
-
-@pytest.fixture
-def sample_asset(app, sample_asset_type):
-    """Create a sample asset for testing"""
-    asset = Asset(asset_type_id=sample_asset_type.id)
-    db.session.add(asset)
-    db.session.commit()
-    
-    asset.set_value('Serial Number', 'ABC123')
-    asset.set_value('Model', 'ThinkPad')
-    db.session.commit()
-    return asset
+from models import Asset, AssetType, AssetField, AssetValue, FieldType
+from schema_cache import schema_cache
 
 def test_create_asset(client, sample_asset_type):
     """Test creating a new asset"""
@@ -120,3 +113,425 @@ def test_update_asset_with_invalid_field(client, sample_asset):
     response = client.put(f'/api/assets/{sample_asset.id}/',
                         json=data)
     assert response.status_code == 400
+
+def test_invalid_asset_data_reports_every_field(client, sample_asset):
+    """Test that create, update and bulk requests list every invalid field and write nothing"""
+    type_id = client.post('/api/asset-types/', json={
+        'name': 'Phone', 'fields': [{'name': 'Model', 'field_type': 'text'}, {'name': 'Price', 'field_type': 'number'}]
+    }).get_json()['id']
+    expected = [
+        {'field': 'Color', 'message': 'Field Color is not defined for this asset type'},
+        {'field': 'Model', 'message': 'Field Model cannot be null'},
+        {'field': 'Price', 'message': 'Invalid number value for field Price'},
+    ]
+    data = {'Model': None, 'Price': 'cheap', 'Color': 'Black'}
+
+    response = client.post('/api/assets/', json={'asset_type_id': type_id, 'data': data})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == expected
+    response = client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Model': 1, 'Price': 2}})
+    assert response.get_json()['errors'] == [{'field': 'Price', 'message': 'Field Price is not defined for this asset type'}]
+    response = client.post('/api/assets/bulk/', json={'assets': [{'asset_type_id': type_id, 'data': data}]})
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['errors'] == expected
+
+    assert client.get(f'/api/assets/?asset_type_id={type_id}').get_json() == []
+    assert client.get(f'/api/assets/{sample_asset.id}/').get_json()['data']['Model'] == 'ThinkPad'
+
+def test_number_values_parsed(client):
+    """Test which JSON values a NUMBER field accepts"""
+    type_id = client.post('/api/asset-types/', json={
+        'name': 'Phone', 'fields': [{'name': 'Price', 'field_type': 'number'}]
+    }).get_json()['id']
+    for value, stored in [(5, 5.0), (2.5, 2.5), (' 1e3 ', 1000.0), ('-.5', -0.5)]:
+        response = client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Price': value}})
+        assert response.get_json()['data']['Price'] == stored
+    for value in [True, 'nan', 'inf', '1e400', '1_000', '', [1], {'value': 1}]:
+        response = client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Price': value}})
+        assert response.status_code == 400
+    # Read by the JSON parser as floats that are not finite, or as an int too large for a float
+    for literal in ['NaN', 'Infinity', '-Infinity', '1e400', '1' + '0' * 400]:
+        body = '{"asset_type_id": %d, "data": {"Price": %s}}' % (type_id, literal)
+        response = client.post('/api/assets/', data=body, content_type='application/json')
+        assert response.status_code == 400
+        assert response.get_json()['errors'] == [
+            {'field': 'Price', 'message': 'Invalid number value for field Price'}]
+
+def _count_statements(client, url):
+    """Issue a GET and return how many SQL statements it executed"""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert response.status_code == 200
+    return len(statements)
+
+def test_list_assets_statement_count_is_flat(client, sample_asset_type):
+    """Test that listing assets does not issue a query per asset"""
+    def add_assets(count):
+        for i in range(count):
+            asset = Asset(asset_type=sample_asset_type)
+            db.session.add(asset)
+            asset.set_value('Serial Number', f'SN{i}')
+            asset.set_value('Model', 'ThinkPad')
+        db.session.commit()
+        db.session.expire_all()
+
+    add_assets(2)
+    client.get('/api/assets/')  # warm the schema cache
+    few = _count_statements(client, '/api/assets/')
+    add_assets(20)
+    many = _count_statements(client, '/api/assets/')
+    assert few == many
+
+def test_get_assets_paginated(client, sample_asset_type):
+    """Test walking the asset list one keyset page at a time"""
+    for i in range(5):
+        response = client.post('/api/assets/', json={
+            'asset_type_id': sample_asset_type.id,
+            'data': {'Serial Number': f'SN{i}'}
+        })
+        assert response.status_code == 201
+
+    response = client.get('/api/assets/?limit=2')
+    assert response.status_code == 200
+    page = response.get_json()
+    assert [a['data']['Serial Number'] for a in page['items']] == ['SN0', 'SN1']
+    assert page['limit'] == 2
+
+    seen = [a['id'] for a in page['items']]
+    while page['next_cursor'] is not None:
+        response = client.get(f'/api/assets/?limit=2&after={page["next_cursor"]}'
+                              f'&asset_type_id={sample_asset_type.id}')
+        page = response.get_json()
+        seen.extend(a['id'] for a in page['items'])
+    assert len(seen) == 5
+    assert seen == sorted(seen)
+
+def test_get_assets_invalid_limit(client):
+    """Test that an out of range page size is rejected"""
+    response = client.get('/api/assets/?limit=0')
+    assert response.status_code == 400
+
+def test_export_assets_ndjson(client, sample_asset):
+    """Test streaming assets as newline delimited JSON"""
+    response = client.get('/api/assets/export/')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 1
+    exported = json.loads(lines[0])
+    assert exported['id'] == sample_asset.id
+    assert exported['data']['Serial Number'] == 'ABC123'
+
+def test_export_assets_csv(client, sample_asset, sample_asset_type):
+    """Test streaming assets of one type as CSV"""
+    response = client.get(f'/api/assets/export/?format=csv&asset_type_id={sample_asset_type.id}')
+    assert response.status_code == 200
+
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0][:2] == ['id', 'asset_type_id']
+    assert set(rows[0][2:]) == {'Serial Number', 'Model'}
+    exported = dict(zip(rows[0], rows[1]))
+    assert exported['Serial Number'] == 'ABC123'
+    assert exported['Model'] == 'ThinkPad'
+
+def test_export_assets_csv_requires_type(client):
+    """Test that a CSV export without an asset type is rejected"""
+    response = client.get('/api/assets/export/?format=csv')
+    assert response.status_code == 400
+
+def test_bulk_create_assets(client, sample_asset_type):
+    """Test creating many assets at once with per-record errors"""
+    data = {
+        'assets': [
+            {'asset_type_id': sample_asset_type.id, 'data': {'Serial Number': 'A1', 'Model': 'XPS'}},
+            {'asset_type_id': sample_asset_type.id, 'data': {'Invalid Field': 'Value'}},
+            {'asset_type_id': 999, 'data': {}},
+            {'asset_type_id': sample_asset_type.id, 'data': {'Serial Number': 'A2'}}
+        ]
+    }
+
+    response = client.post('/api/assets/bulk/', json=data)
+    assert response.status_code == 201
+
+    json_data = response.get_json()
+    assert [c['index'] for c in json_data['created']] == [0, 3]
+    assert [e['index'] for e in json_data['errors']] == [1, 2]
+
+    created = client.get(f'/api/assets/{json_data["created"][0]["id"]}/').get_json()
+    assert created['data'] == {'Serial Number': 'A1', 'Model': 'XPS'}
+    assert len(client.get('/api/assets/').get_json()) == 2
+
+def test_bulk_create_assets_all_invalid(client, sample_asset_type):
+    """Test that a bulk request with no valid record is rejected"""
+    data = {'assets': [
+        {'asset_type_id': sample_asset_type.id, 'data': {'Invalid Field': 'Value'}},
+        {'asset_type_id': [sample_asset_type.id], 'data': {}},
+        {'asset_type_id': True, 'data': {}},
+        {'asset_type_id': sample_asset_type.id},
+    ]}
+
+    response = client.post('/api/assets/bulk/', json=data)
+    assert response.status_code == 400
+    errors = response.get_json()['errors']
+    assert [e['index'] for e in errors] == [0, 1, 2, 3]
+    assert errors[1]['message'] == errors[2]['message'] == 'asset_type_id must be an integer'
+    assert errors[3]['message'] == 'Asset data must be an object'
+
+def test_bulk_update_assets(client, sample_asset, sample_asset_type):
+    """Test updating many assets at once with per-record errors"""
+    created = client.post('/api/assets/', json={
+        'asset_type_id': sample_asset_type.id,
+        'data': {'Serial Number': 'B1', 'Model': 'XPS'}
+    }).get_json()
+    data = {
+        'assets': [
+            {'id': sample_asset.id, 'data': {'Model': 'Yoga'}},
+            {'id': created['id'], 'data': {'Serial Number': 'B2'}},
+            {'id': 999, 'data': {}},
+            {'id': created['id'], 'data': {'Invalid Field': 'Value'}}
+        ]
+    }
+
+    response = client.patch('/api/assets/', json=data)
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert [u['index'] for u in json_data['updated']] == [0, 1]
+    assert [e['index'] for e in json_data['errors']] == [2, 3]
+
+    assert client.get(f'/api/assets/{sample_asset.id}/').get_json()['data'] == {
+        'Serial Number': 'ABC123', 'Model': 'Yoga'
+    }
+    assert client.get(f'/api/assets/{created["id"]}/').get_json()['data'] == {
+        'Serial Number': 'B2', 'Model': 'XPS'
+    }
+    # Documents are kept in sync, including the one the fixture asset never had
+    assert db.session.get(Asset, sample_asset.id).document == {'Serial Number': 'ABC123', 'Model': 'Yoga'}
+    assert db.session.get(Asset, created['id']).document == {'Serial Number': 'B2', 'Model': 'XPS'}
+
+def test_bulk_update_assets_all_invalid(client):
+    """Test that a bulk update with no valid record is rejected"""
+    response = client.patch('/api/assets/', json={'assets': [
+        {'id': 999, 'data': {}}, {'id': {'id': 1}, 'data': {}}, {'id': True, 'data': {}}
+    ]})
+    assert response.status_code == 400
+    errors = response.get_json()['errors']
+    assert [e['index'] for e in errors] == [0, 1, 2]
+    assert errors[1]['message'] == errors[2]['message'] == 'id must be an integer'
+
+def test_filter_assets_by_field_values(client):
+    """Test filtering assets with typed predicates over their field values"""
+    response = client.post('/api/asset-types/', json={
+        'name': 'Phone',
+        'fields': [
+            {'name': 'Model', 'field_type': 'text'},
+            {'name': 'Price', 'field_type': 'number'}
+        ]
+    })
+    type_id = response.get_json()['id']
+    for model, price in [('Pixel', 800), ('Pixel', 1200), ('iPhone', 900)]:
+        client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Model': model, 'Price': price}})
+
+    response = client.get('/api/assets/?filter[Model]=Pixel&filter[Price][lt]=1000')
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert len(json_data) == 1
+    assert json_data[0]['data'] == {'Model': 'Pixel', 'Price': 800}
+
+    response = client.get('/api/assets/?filter[Price][gte]=900&limit=10')
+    assert len(response.get_json()['items']) == 2
+
+def test_filter_assets_invalid(client, sample_asset):
+    """Test that filters on unknown fields or operators are rejected"""
+    assert client.get('/api/assets/?filter[Unknown]=x').status_code == 400
+    assert client.get('/api/assets/?filter[Model][like]=x').status_code == 400
+
+def test_create_asset_with_unknown_type(client):
+    """Test creating an asset for an asset type that doesn't exist"""
+    response = client.post('/api/assets/', json={'asset_type_id': 999, 'data': {}})
+    assert response.status_code == 400
+
+@pytest.fixture
+def document_reads(app):
+    app.config['ASSET_DOCUMENT_READS'] = True
+    yield
+    app.config['ASSET_DOCUMENT_READS'] = False
+
+def test_document_kept_in_sync(client, sample_asset_type, document_reads):
+    """Test that asset reads are served from the document written on create and update"""
+    response = client.post('/api/assets/', json={
+        'asset_type_id': sample_asset_type.id,
+        'data': {'Serial Number': 'XYZ789'}
+    })
+    asset_id = response.get_json()['id']
+    assert db.session.get(Asset, asset_id).document == {'Serial Number': 'XYZ789'}
+
+    client.put(f'/api/assets/{asset_id}/', json={'data': {'Model': 'MacBook'}})
+    response = client.get(f'/api/assets/{asset_id}/')
+    assert response.get_json()['data'] == {'Serial Number': 'XYZ789', 'Model': 'MacBook'}
+
+def test_rebuild_asset_documents(app, client, sample_asset, document_reads):
+    """Test rebuilding documents for assets written before the column existed"""
+    assert sample_asset.document is None
+    # Reads fall back to asset_values until the document is built
+    response = client.get(f'/api/assets/{sample_asset.id}/')
+    assert response.get_json()['data']['Model'] == 'ThinkPad'
+
+    result = app.test_cli_runner().invoke(args=['rebuild-asset-documents'])
+    assert 'Rebuilt 1 asset documents' in result.output
+    assert db.session.get(Asset, sample_asset.id).document == {'Serial Number': 'ABC123', 'Model': 'ThinkPad'}
+
+def test_get_asset_not_modified(client, sample_asset):
+    """Test that a request with a current ETag gets an empty 304"""
+    response = client.get(f'/api/assets/{sample_asset.id}/')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    response = client.get(f'/api/assets/{sample_asset.id}/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Model': 'XPS'}})
+    response = client.get(f'/api/assets/{sample_asset.id}/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_list_assets_not_modified(client, sample_asset, sample_asset_type):
+    """Test that the asset list ETag changes when an asset is added"""
+    etag = client.get('/api/assets/').headers['ETag']
+    assert client.get('/api/assets/', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/assets/', json={'asset_type_id': sample_asset_type.id, 'data': {}})
+    assert client.get('/api/assets/', headers={'If-None-Match': etag}).status_code == 200
+
+def test_list_page_not_modified(client, sample_asset, sample_asset_type):
+    """Test that a keyset page is versioned by its own rows, not by the rest of the list"""
+    ids = [sample_asset.id] + [
+        client.post('/api/assets/', json={'asset_type_id': sample_asset_type.id, 'data': {}}).get_json()['id']
+        for _ in range(2)
+    ]
+    etag = client.get('/api/assets/?limit=1').headers['ETag']
+
+    client.put(f'/api/assets/{ids[2]}/', json={'data': {'Model': 'XPS'}})
+    assert client.get('/api/assets/?limit=1', headers={'If-None-Match': etag}).status_code == 304
+    client.put(f'/api/assets/{ids[0]}/', json={'data': {'Model': 'XPS'}})
+    assert client.get('/api/assets/?limit=1', headers={'If-None-Match': etag}).status_code == 200
+
+def test_update_asset_if_match(client, sample_asset):
+    """Test optimistic concurrency on updates with If-Match"""
+    etag = client.get(f'/api/assets/{sample_asset.id}/').headers['ETag']
+
+    response = client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Model': 'XPS'}},
+                          headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    # A second writer still holding the old ETag is rejected
+    response = client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Model': 'Yoga'}},
+                          headers={'If-Match': etag})
+    assert response.status_code == 412
+
+@pytest.mark.parametrize('url', ['/api/assets/', '/api/assets/?limit=10', '/api/asset-types/'])
+def test_fast_serializer_matches_marshal(app, client, sample_asset, url):
+    """Test that the fast serializer builds the same payloads as flask-restx marshal"""
+    fast = client.get(url).get_json()
+    app.config['FAST_SERIALIZER'] = False
+    try:
+        marshalled = client.get(url).get_json()
+    finally:
+        app.config['FAST_SERIALIZER'] = True
+    assert fast == marshalled
+
+@pytest.mark.parametrize('document_reads_on', [False, True])
+def test_list_assets_matches_single_reads(app, client, sample_asset, sample_asset_type, document_reads_on):
+    """Test that list rows pivoted without the ORM match the single asset payloads"""
+    app.config['ASSET_DOCUMENT_READS'] = document_reads_on
+    try:
+        # One asset with a document, one without values and the fixture asset without a document
+        client.post('/api/assets/', json={'asset_type_id': sample_asset_type.id, 'data': {'Model': 'XPS'}})
+        client.post('/api/assets/', json={'asset_type_id': sample_asset_type.id, 'data': {}})
+        listed = client.get('/api/assets/').get_json()
+        assert len(listed) == 3
+        for item in listed:
+            assert item == client.get(f'/api/assets/{item["id"]}/').get_json()
+        assert listed[2]['data'] == {'Serial Number': None, 'Model': None}
+    finally:
+        app.config['ASSET_DOCUMENT_READS'] = False
+
+def test_search_assets(client, sample_asset_type):
+    """Test substring and prefix search over text values, ranked by how much of a value matches"""
+    type_id = sample_asset_type.id
+    ids = [
+        client.post('/api/assets/', json={'asset_type_id': type_id, 'data': data}).get_json()['id']
+        for data in [{'Serial Number': 'XPS', 'Model': 'Dell XPS 13'},
+                     {'Serial Number': 'SN-1', 'Model': 'xps'},
+                     {'Serial Number': 'SN-2', 'Model': 'ThinkPad'}]
+    ]
+
+    response = client.get(f'/api/assets/search/?q=xps&asset_type_id={type_id}')
+    assert response.status_code == 200
+    page = response.get_json()
+    assert [hit['id'] for hit in page['items']] == [ids[0], ids[1]]
+    assert page['items'][0]['score'] == 1.0 and page['next_offset'] is None
+
+    page = client.get(f'/api/assets/search/?q=xps&asset_type_id={type_id}&fields=Model').get_json()
+    assert [hit['id'] for hit in page['items']] == [ids[1], ids[0]]
+    page = client.get(f'/api/assets/search/?q=de&asset_type_id={type_id}&mode=prefix').get_json()
+    assert [hit['id'] for hit in page['items']] == [ids[0]]
+    page = client.get(f'/api/assets/search/?q=SN-&asset_type_id={type_id}&limit=1&offset=1').get_json()
+    assert [hit['id'] for hit in page['items']] == [ids[2]] and page['next_offset'] is None
+
+    # The index follows updates
+    client.put(f'/api/assets/{ids[2]}/', json={'data': {'Model': 'XPS 15'}})
+    page = client.get(f'/api/assets/search/?q=xps 1&asset_type_id={type_id}&fields=Model').get_json()
+    assert [hit['id'] for hit in page['items']] == [ids[2], ids[0]]
+    page = client.get(f'/api/assets/search/?q=100%&asset_type_id={type_id}').get_json()
+    assert page['items'] == []
+
+def test_search_assets_invalid(client, sample_asset_type):
+    """Test that searches on unknown types, non-text fields or bad modes are rejected"""
+    type_id = sample_asset_type.id
+    assert client.get('/api/assets/search/?q=x').status_code == 400
+    assert client.get('/api/assets/search/?q=x&asset_type_id=999').status_code == 404
+    assert client.get(f'/api/assets/search/?q=x&asset_type_id={type_id}&fields=Price').status_code == 400
+    assert client.get(f'/api/assets/search/?q=x&asset_type_id={type_id}&mode=fuzzy').status_code == 400
+
+def test_asset_values_carry_asset_type(client, sample_asset, sample_asset_type):
+    """Test that every write path stores the asset's type on its values, which scopes filters to the type"""
+    other = client.post('/api/asset-types/', json={
+        'name': 'Monitor', 'fields': [{'name': 'Model', 'field_type': 'text'}]
+    }).get_json()['id']
+    other_thinkpad = client.post('/api/assets/', json={
+        'asset_type_id': other, 'data': {'Model': 'ThinkPad'}
+    }).get_json()
+    bulk = client.post('/api/assets/bulk/', json={'assets': [
+        {'asset_type_id': sample_asset_type.id, 'data': {'Model': 'ThinkPad'}},
+        {'asset_type_id': other, 'data': {'Model': 'UltraSharp'}},
+    ]}).get_json()
+    client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Serial Number': 'XYZ789'}})
+
+    rows = db.session.query(AssetValue.asset_type_id, Asset.asset_type_id).join(Asset).all()
+    assert len(rows) == 5 and all(value_type == asset_type for value_type, asset_type in rows)
+    response = client.get(f'/api/assets/?asset_type_id={sample_asset_type.id}&filter[Model]=ThinkPad')
+    found = response.get_json()
+    assert sorted(asset['id'] for asset in found) == [sample_asset.id, bulk['created'][0]['id']]
+    assert other_thinkpad['id'] not in [asset['id'] for asset in found]
+
+def test_asset_values_lookup_by_asset_uses_index(app):
+    """Test that per-asset value lookups, as behind Asset.values, do not scan asset_values"""
+    plan = db.session.execute(text('EXPLAIN QUERY PLAN SELECT * FROM asset_values WHERE asset_id IN (1, 2, 3)')).all()
+    assert any('USING INDEX ix_asset_values_asset_id' in row[-1] for row in plan)
+
+def test_schema_data_copies_type_template(app, sample_asset_type):
+    """Test that data dicts built from a type's template are independent of it and of each other"""
+    schema = schema_cache.get(sample_asset_type.id)
+    first = schema.data([])
+    first['Model'] = 'XPS'
+    assert schema.data([]) == {'Serial Number': None, 'Model': None}
+    assert schema.document_data({'Model': 'T14', 'Removed': 1}) == {'Serial Number': None, 'Model': 'T14'}
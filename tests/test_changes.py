@@ -0,0 +1,44 @@
+def test_change_feed(client):
+    """Test that asset and asset type mutations are logged in order and read in batches"""
+    response = client.post('/api/asset-types/', json={
+        'name': 'Phone',
+        'fields': [{'name': 'Model', 'field_type': 'text'}]
+    })
+    type_id = response.get_json()['id']
+    client.post(f'/api/asset-types/{type_id}/fields/', json={'name': 'Price', 'field_type': 'number'})
+    asset_id = client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Model': 'Pixel'}}).get_json()['id']
+    client.put(f'/api/assets/{asset_id}/', json={'data': {'Price': 800}})
+    client.patch('/api/assets/', json={'assets': [{'id': asset_id, 'data': {'Model': 'Pixel 2'}}]})
+    created = client.post('/api/assets/bulk/', json={'assets': [{'asset_type_id': type_id, 'data': {}}]}).get_json()
+
+    response = client.get('/api/changes/')
+    assert response.status_code == 200
+    page = response.get_json()
+    assert [(c['entity'], c['entity_id'], c['op']) for c in page['items']] == [
+        ('asset_type', type_id, 'create'),
+        ('asset_type', type_id, 'add_field'),
+        ('asset', asset_id, 'create'),
+        ('asset', asset_id, 'update'),
+        ('asset', asset_id, 'update'),
+        ('asset', created['created'][0]['id'], 'create'),
+    ]
+    assert [c['data'] for c in page['items'][:5]] == [
+        {'name': 'Phone', 'fields': {'Model': 'text'}},
+        {'name': 'Phone', 'fields': {'Price': 'number'}},
+        {'Model': 'Pixel'},
+        {'Price': 800.0},
+        {'Model': 'Pixel 2'},
+    ]
+    seqs = [c['seq'] for c in page['items']]
+    assert seqs == sorted(seqs) and page['next_since'] == seqs[-1]
+
+    page = client.get(f'/api/changes/?since={seqs[1]}&limit=2').get_json()
+    assert [c['seq'] for c in page['items']] == seqs[2:4] and page['next_since'] == seqs[3]
+    page = client.get(f'/api/changes/?since={seqs[-1]}').get_json()
+    assert page == {'items': [], 'next_since': seqs[-1]}
+    assert client.get('/api/changes/?asset_type_id=999').get_json()['items'] == []
+
+def test_failed_mutation_is_not_logged(client, sample_asset):
+    """Test that a rejected update leaves no change behind"""
+    client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Unknown': 'x'}})
+    assert client.get('/api/changes/').get_json()['items'] == []
@@ -0,0 +1,47 @@
+import io
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+
+@pytest.fixture
+def phones(client):
+    response = client.post('/api/asset-types/', json={
+        'name': 'Phone',
+        'fields': [{'name': 'Model', 'field_type': 'text'}, {'name': 'Price', 'field_type': 'number'}]
+    })
+    type_id = response.get_json()['id']
+    client.post('/api/assets/bulk/', json={'assets': [
+        {'asset_type_id': type_id, 'data': {'Model': 'Pixel', 'Price': 800}},
+        {'asset_type_id': type_id, 'data': {'Model': 'iPhone'}},
+    ]})
+    return type_id
+
+EXPECTED = {
+    'Model': ['Pixel', 'iPhone'],
+    'Price': [800.0, None],
+}
+
+def test_export_assets_arrow(client, phones):
+    """Test that an Arrow export has one typed column per field"""
+    response = client.get(f'/api/assets/export/?format=arrow&asset_type_id={phones}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/vnd.apache.arrow.stream'
+    table = pa.ipc.open_stream(io.BytesIO(response.data)).read_all()
+    assert table.schema.field('Model').type == pa.string()
+    assert table.schema.field('Price').type == pa.float64()
+    assert table.column('asset_type_id').to_pylist() == [phones, phones]
+    assert {name: table.column(name).to_pylist() for name in EXPECTED} == EXPECTED
+
+def test_export_assets_parquet(client, phones):
+    """Test that a Parquet export reads back with the field types"""
+    response = client.get(f'/api/assets/export/?format=parquet&asset_type_id={phones}')
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.data))
+    assert table.schema.field('Price').type == pa.float64()
+    assert {name: table.column(name).to_pylist() for name in EXPECTED} == EXPECTED
+
+def test_export_assets_columnar_requires_type(client):
+    """Test that columnar exports without an existing asset type are rejected"""
+    assert client.get('/api/assets/export/?format=parquet').status_code == 400
+    assert client.get('/api/assets/export/?format=arrow&asset_type_id=999').status_code == 404
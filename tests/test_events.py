@@ -0,0 +1,68 @@
+import pytest
+from events import broker
+
+@pytest.fixture
+def short_heartbeat(app):
+    app.config['EVENTS_HEARTBEAT_SECONDS'] = 0.01
+    yield
+    app.config['EVENTS_HEARTBEAT_SECONDS'] = 15
+
+def test_broker_publishes_committed_changes(client, sample_asset, sample_asset_type):
+    """Test that subscriptions get the create and update events they filter for, once committed"""
+    everything = broker.subscribe()
+    followed = broker.subscribe(ids=[sample_asset.id])
+    other_type = broker.subscribe(asset_type_id=999)
+    try:
+        created = client.post('/api/assets/', json={
+            'asset_type_id': sample_asset_type.id, 'data': {'Model': 'XPS'}
+        }).get_json()
+        client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Model': 'T14'}})
+        client.put(f'/api/assets/{sample_asset.id}/', json={'data': {'Unknown': 'x'}})
+
+        events = [everything.queue.get_nowait() for _ in range(2)]
+        assert [(e['id'], e['op'], e['data']) for e in events] == [
+            (created['id'], 'create', {'Model': 'XPS'}),
+            (sample_asset.id, 'update', {'Model': 'T14'}),
+        ]
+        assert events[0]['seq'] < events[1]['seq']
+        assert everything.queue.empty()
+        assert followed.queue.get_nowait()['id'] == sample_asset.id and followed.queue.empty()
+        assert other_type.queue.empty()
+    finally:
+        for subscription in (everything, followed, other_type):
+            broker.unsubscribe(subscription)
+
+def test_asset_event_stream(client, sample_asset_type, short_heartbeat):
+    """Test that the stream replays missed events, then relays live ones between heartbeats"""
+    type_id = sample_asset_type.id
+    first = client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Model': 'A'}}).get_json()
+
+    response = client.get(f'/api/assets/events/?asset_type_id={type_id}', headers={'Last-Event-ID': '0'},
+                          buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    stream = (chunk.decode() for chunk in response.response)
+    assert next(stream) == ': connected\n\n'
+    replayed = next(stream)
+    assert replayed.startswith('id: ') and '\nevent: create\n' in replayed and f'"id":{first["id"]}' in replayed
+    assert next(stream) == ': heartbeat\n\n'
+
+    second = client.post('/api/assets/', json={'asset_type_id': type_id, 'data': {'Model': 'B'}}).get_json()
+    live = next(stream)
+    assert f'"id":{second["id"]}' in live and '"data":{"Model":"B"}' in live
+    response.close()
+
+def test_event_streams_limited_per_worker(client, sample_asset_type):
+    """Test that streams beyond EVENTS_MAX_STREAMS are refused instead of taking every worker thread"""
+    taken = [broker.subscribe(stream=True) for _ in range(broker.max_streams)]
+    try:
+        response = client.get('/api/assets/events/')
+        assert response.status_code == 503
+        # Plain subscriptions do not count
+        broker.unsubscribe(broker.subscribe())
+    finally:
+        for subscription in taken:
+            broker.unsubscribe(subscription)
+    response = client.get('/api/assets/events/')
+    assert response.status_code == 200
+    response.close()
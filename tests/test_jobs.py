@@ -0,0 +1,82 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from jobs import JobService
+from models import Asset, Job, JobStatus
+
+@pytest.fixture
+def small_batches(app):
+    app.config['JOB_BATCH_SIZE'] = 2
+    yield
+    app.config['JOB_BATCH_SIZE'] = 1000
+
+def test_import_assets_job(client, sample_asset_type, small_batches):
+    """Test that an import runs in chunks, reporting progress and per-record errors"""
+    records = [{'asset_type_id': sample_asset_type.id, 'data': {'Serial Number': f'S{i}'}} for i in range(4)]
+    records.insert(2, {'asset_type_id': 999, 'data': {}})
+    response = client.post('/api/jobs/', json={'kind': 'import_assets', 'params': {'assets': records}})
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+    assert response.get_json()['status'] == 'queued'
+
+    assert JobService.work('test-worker', once=True) == 1
+    job = client.get(f'/api/jobs/{job_id}/').get_json()
+    assert job['status'] == 'succeeded'
+    assert job['progress'] == job['total'] == 5
+    assert job['result']['created'] == 4
+    assert job['result']['errors'] == [{'index': 2, 'message': 'Asset type 999 does not exist'}]
+    assert len(client.get(f'/api/assets/?asset_type_id={sample_asset_type.id}').get_json()) == 4
+
+def test_backfill_field_default_job(client, sample_asset, sample_asset_type, small_batches):
+    """Test that a backfill only fills in assets without a value for the field"""
+    for serial in ['S1', 'S2']:
+        client.post('/api/assets/', json={'asset_type_id': sample_asset_type.id, 'data': {'Serial Number': serial}})
+    response = client.post('/api/jobs/', json={'kind': 'backfill_field_default', 'params': {
+        'asset_type_id': sample_asset_type.id, 'field': 'Model', 'value': 'Unknown'
+    }})
+    assert response.status_code == 202
+
+    JobService.work('test-worker', once=True)
+    job = client.get(f'/api/jobs/{response.get_json()["id"]}/').get_json()
+    assert job['status'] == 'succeeded' and job['progress'] == 3
+    models = [a['data']['Model'] for a in client.get('/api/assets/').get_json()]
+    assert models == ['ThinkPad', 'Unknown', 'Unknown']
+
+def test_claim_job(app, sample_asset_type):
+    """Test that a job is claimed once, and again only after its worker stopped heartbeating"""
+    job_id = JobService.submit_job('import_assets', {'assets': []}).id
+    assert JobService.claim_job('a').id == job_id
+    assert JobService.claim_job('b') is None
+
+    db.session.get(Job, job_id).heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+    db.session.commit()
+    job = JobService.claim_job('b')
+    assert (job.worker, job.attempts, job.status) == ('b', 2, JobStatus.RUNNING)
+
+def test_reclaimed_job_chunk_not_committed(app, sample_asset_type):
+    """Test that a worker whose job was reclaimed meanwhile does not commit its chunk"""
+    records = [{'asset_type_id': sample_asset_type.id, 'data': {}}]
+    job_id = JobService.submit_job('import_assets', {'assets': records}).id
+    job = JobService.claim_job('a')
+    # Another worker reclaims it while 'a' runs, which still holds the job as 'a' claimed it
+    db.session.execute(update(Job).where(Job.id == job_id).values(worker='b', attempts=2))
+    db.session.commit()
+    db.session.refresh(job)
+    set_committed_value(job, 'worker', 'a')
+    set_committed_value(job, 'attempts', 1)
+
+    job = JobService.run_job(job)
+    assert (job.worker, job.status, job.progress) == ('b', JobStatus.RUNNING, 0)
+    assert db.session.query(Asset).count() == 0
+
+def test_submit_job_invalid(client, sample_asset_type):
+    """Test that unknown kinds and bad parameters are rejected on submission"""
+    assert client.post('/api/jobs/', json={'kind': 'reindex', 'params': {}}).status_code == 400
+    assert client.post('/api/jobs/', json={'kind': 'import_assets', 'params': {}}).status_code == 400
+    response = client.post('/api/jobs/', json={'kind': 'backfill_field_default', 'params': {
+        'asset_type_id': sample_asset_type.id, 'field': 'Price', 'value': 1
+    }})
+    assert response.status_code == 400
+    assert client.get('/api/jobs/999/').status_code == 404
@@ -0,0 +1,27 @@
+import pytest
+
+def test_metrics_endpoint(client, sample_asset):
+    """Test that per-endpoint histograms are exposed in the Prometheus format"""
+    client.get('/api/assets/')
+    client.get(f'/api/assets/{sample_asset.id}/')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+
+    body = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert 'db_queries_per_request_count{endpoint="/api/assets/",method="GET"}' in body
+    assert 'serialization_seconds_sum{endpoint="/api/assets/<int:asset_id>/",method="GET"}' in body
+    assert 'schema_cache_misses_total' in body
+
+def test_debug_queries_header(app, client, sample_asset):
+    """Test that development mode reports the query count of each response"""
+    assert 'X-Debug-Queries' not in client.get('/api/assets/').headers
+
+    app.config['DEBUG'] = True
+    try:
+        response = client.get(f'/api/assets/{sample_asset.id}/')
+    finally:
+        app.config['DEBUG'] = False
+    assert int(response.headers['X-Debug-Queries']) > 0
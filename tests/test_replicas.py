@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import create_engine, insert
+from app import db
+from models import AssetType
+from replicas import replicas, PRIMARY_COOKIE
+
+@pytest.fixture
+def replica(app, tmp_path, monkeypatch):
+    engine = create_engine(f'sqlite:///{tmp_path / "replica.db"}')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(AssetType), [{'name': 'Replica Only'}])
+    db.engines['replica_0'] = engine
+    monkeypatch.setattr(replicas, 'keys', ['replica_0'])
+    yield engine
+    del db.engines['replica_0']
+    engine.dispose()
+
+def test_reads_go_to_replica(client, sample_asset_type, replica):
+    """Test that GET requests read from the replica and writes go to the primary"""
+    assert [t['name'] for t in client.get('/api/asset-types/').get_json()] == ['Replica Only']
+
+    response = client.post('/api/asset-types/', json={'name': 'Monitor', 'fields': []})
+    assert response.status_code == 201
+    assert PRIMARY_COOKIE in response.headers['Set-Cookie']
+    assert db.session.get(AssetType, response.get_json()['id']).name == 'Monitor'
+
+def test_read_your_writes(app, client, replica):
+    """Test that a client that just wrote keeps reading from the primary"""
+    client.post('/api/asset-types/', json={'name': 'Monitor', 'fields': []})
+    assert [t['name'] for t in client.get('/api/asset-types/').get_json()] == ['Monitor']
+
+    other_client = app.test_client()
+    other_client.environ_base['HTTP_X_API_KEY'] = 'Dyn4m1cAsS3tKey'
+    assert [t['name'] for t in other_client.get('/api/asset-types/').get_json()] == ['Replica Only']
+
+def test_event_replay_reads_primary(app, client, sample_asset_type, replica, monkeypatch):
+    """Test that the event stream replays changes from the primary, which replicas may not have yet"""
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT_SECONDS', 0.01)
+    created = client.post('/api/assets/', json={
+        'asset_type_id': sample_asset_type.id, 'data': {'Model': 'XPS'}
+    }).get_json()
+
+    other_client = app.test_client()
+    other_client.environ_base['HTTP_X_API_KEY'] = 'Dyn4m1cAsS3tKey'
+    response = other_client.get('/api/assets/events/', headers={'Last-Event-ID': '0'}, buffered=False)
+    stream = (chunk.decode() for chunk in response.response)
+    assert next(stream) == ': connected\n\n'
+    assert f'"id":{created["id"]}' in next(stream)
+    response.close()
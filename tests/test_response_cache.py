@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import update
+from app import db
+from models import Asset, AssetValue
+from response_cache import response_cache, MemoryBackend, RedisBackend
+from schema_cache import SchemaCache
+
+@pytest.fixture(params=['memory', 'redis'])
+def cache_backend(request, app):
+    if request.param == 'memory':
+        backend = MemoryBackend()
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        backend = RedisBackend(fakeredis.FakeRedis())
+    response_cache.backend = backend
+    yield backend
+    response_cache.backend = None
+
+def test_get_asset_cached_until_updated(client, sample_asset, cache_backend):
+    """Test that an asset is served from the cache until it is updated"""
+    url = f'/api/assets/{sample_asset.id}/'
+    assert client.get(url).headers['X-Cache'] == 'MISS'
+    response = client.get(url)
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.get_json()['data']['Model'] == 'ThinkPad'
+    assert response.headers['ETag']
+
+    client.put(url, json={'data': {'Model': 'XPS'}})
+    response = client.get(url)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['data']['Model'] == 'XPS'
+
+def test_list_assets_cached_until_created(client, sample_asset, sample_asset_type, cache_backend):
+    """Test that asset lists are invalidated by new assets"""
+    client.get('/api/assets/')
+    assert client.get('/api/assets/').headers['X-Cache'] == 'HIT'
+
+    client.post('/api/assets/', json={'asset_type_id': sample_asset_type.id, 'data': {}})
+    response = client.get('/api/assets/')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert len(response.get_json()) == 2
+
+def test_asset_type_fields_cached_until_field_added(client, sample_asset, sample_asset_type, cache_backend):
+    """Test that adding a field invalidates the type's fields and its assets but not unrelated entries"""
+    fields_url = f'/api/asset-types/{sample_asset_type.id}/fields/'
+    asset_url = f'/api/assets/{sample_asset.id}/'
+    client.get(fields_url)
+    client.get(asset_url)
+    assert client.get(fields_url).headers['X-Cache'] == 'HIT'
+
+    client.post(fields_url, json={'name': 'RAM', 'field_type': 'number'})
+    assert len(client.get(fields_url).get_json()) == 3
+    assert client.get(asset_url).get_json()['data']['RAM'] is None
+
+def test_cached_body_keyed_by_version(client, sample_asset, cache_backend):
+    """Test that a write the cache was not told about is not hidden behind a cached body"""
+    url = f'/api/assets/{sample_asset.id}/'
+    client.get(url)
+    assert client.get(url).headers['X-Cache'] == 'HIT'
+
+    # As if a reader stored its body just after a writer invalidated the entry
+    db.session.execute(update(AssetValue).where(AssetValue.asset_id == sample_asset.id,
+                                                AssetValue.text_value == 'ThinkPad').values(text_value='XPS'))
+    db.session.execute(update(Asset).where(Asset.id == sample_asset.id).values(document=None))
+    db.session.commit()
+    response = client.get(url)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['data']['Model'] == 'XPS'
+
+def test_schema_invalidated_in_other_workers(client, sample_asset_type, cache_backend):
+    """Test that a field added in one worker reaches the schemas other workers cached, through the backend"""
+    other_worker = SchemaCache()
+    assert list(other_worker.get(sample_asset_type.id).fields) == ['Serial Number', 'Model']
+    assert other_worker.get(sample_asset_type.id) is other_worker.get(sample_asset_type.id)
+
+    client.post(f'/api/asset-types/{sample_asset_type.id}/fields/', json={'name': 'RAM', 'field_type': 'number'})
+    assert list(other_worker.get(sample_asset_type.id).fields) == ['Serial Number', 'Model', 'RAM']
+    assert other_worker.stats()['misses'] == 2